@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Микробенчмарк генераторов позиций и кликов.
+
+Генераторы не ходят в БД, поэтому измеряются отдельно на синтетической
+выборке с реалистичными распределениями: показы — логнормальные с
+длинным хвостом, средние позиции смещены к топу, клики — биномиальные
+по CTR позиции. Для каждого бенчмарка печатается время в нс на
+сгенерированную строку (позицию или клик) и выделения памяти по
+tracemalloc.
+
+Результаты дописываются в benchmarks/results/generators.jsonl вместе с
+хэшем коммита. Каждый прогон сравнивается с последним прогоном того же
+бенчмарка и параметров на той же машине с теми же версиями Python и
+numpy. С --max-regression скрипт завершается с кодом 1, если какой-то
+бенчмарк замедлился сильнее заданной доли.
+
+    python benchmarks/bench_generators.py --rows 20000 --max-regression 0.2
+"""
+
+import argparse
+import json
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+from src.etl.positions_generator import PositionsGeneratorETL
+from src.etl.clicks_generator import ClicksGeneratorETL, POSITION_WEIGHTS, DEFAULT_POSITION_WEIGHT
+from src.etl.seeding import row_seeds
+
+DEFAULT_OUTPUT = ROOT / 'benchmarks' / 'results' / 'generators.jsonl'
+# Поля окружения, без совпадения которых прогоны не сравниваются
+ENVIRONMENT_KEYS = ('python', 'numpy', 'machine', 'hostname')
+
+
+def make_dataset(rows: int, seed: int) -> pd.DataFrame:
+    """Синтетические строки ppl.webmaster_aggregated с реалистичными распределениями"""
+    rng = np.random.default_rng(seed)
+    impressions = np.clip(np.rint(rng.lognormal(1.5, 1.2, rows)), 1, 5000).astype(np.int64)
+    position = np.round(np.clip(1 + rng.gamma(2.0, 6.0, rows), 1, 100), 1)
+    top = np.clip(np.rint(position).astype(np.int64), 0, len(POSITION_WEIGHTS) - 1)
+    ctr = np.where(position < len(POSITION_WEIGHTS), POSITION_WEIGHTS[top], DEFAULT_POSITION_WEIGHT)
+    clicks = rng.binomial(impressions, np.clip(ctr, 0, 1))
+    return pd.DataFrame({
+        'id': np.arange(1, rows + 1, dtype=np.int64),
+        'date': pd.Timestamp('2024-01-01').date(),
+        'query': [f"query {i}" for i in range(rows)],
+        'page_path': [f"/page/{i % 500}" for i in range(rows)],
+        'device': np.array(['desktop', 'mobile', 'tablet'])[np.arange(rows) % 3],
+        'impressions': impressions,
+        'clicks': clicks,
+        'position': position,
+    })
+
+
+def environment() -> Dict[str, str]:
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'hostname': socket.gethostname()}
+
+
+def history_key(benchmark: str, params: dict, env: dict) -> tuple:
+    return (benchmark, json.dumps(params, sort_keys=True),
+            json.dumps({key: env.get(key) for key in ENVIRONMENT_KEYS}, sort_keys=True))
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"нужно целое число не меньше 1, получено {value}")
+    return number
+
+
+def git_revision() -> Dict[str, object]:
+    def run(*args) -> str:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    try:
+        return {'commit': run('rev-parse', '--short', 'HEAD') or None,
+                'dirty': bool(run('status', '--porcelain', '--untracked-files=no'))}
+    except OSError:
+        return {'commit': None, 'dirty': None}
+
+
+def measure(func: Callable[[], int], repeat: int) -> Dict[str, float]:
+    """Время прогонов и выделения памяти одного прогона под tracemalloc"""
+    func()  # прогрев
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        generated = func()
+        timings.append(time.perf_counter_ns() - started)
+
+    tracemalloc.start()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size for stat in snapshot.statistics('filename'))
+
+    generated = max(generated, 1)
+    return {
+        'generated_rows': generated,
+        'ns_per_row': round(min(timings) / generated, 2),
+        'ns_per_row_median': round(statistics.median(timings) / generated, 2),
+        'peak_alloc_bytes': peak,
+        'peak_alloc_bytes_per_row': round(peak / generated, 2),
+        'retained_bytes': allocated,
+    }
+
+
+def build_benchmarks(df: pd.DataFrame, per_row_rows: int, seed: int) -> Dict[str, Callable[[], int]]:
+    positions_etl = PositionsGeneratorETL()
+    clicks_etl = ClicksGeneratorETL()
+
+    impressions = df['impressions'].to_numpy(dtype=np.int64)
+    avg_positions = df['position'].to_numpy(dtype=np.float64)
+    position_seeds = row_seeds(seed, 'positions', df)
+    click_seeds = row_seeds(seed, 'clicks', df)
+
+    # Позиции для кликов берем из самого генератора, как в пайплайне
+    positions = positions_etl._generate_positions_batch(impressions, avg_positions, position_seeds)
+    offsets = np.append(0, np.cumsum(impressions))
+    orders = np.arange(len(positions)) - np.repeat(offsets[:-1], impressions) + 1
+    row_ids = df['id'].to_numpy(dtype=np.int64)
+    clicks = df['clicks'].to_numpy(dtype=np.int64)
+
+    sample = range(min(per_row_rows, len(df)))
+
+    def positions_array() -> int:
+        return sum(len(positions_etl._generate_positions_array(int(impressions[i]), float(avg_positions[i]),
+                                                                int(position_seeds[i])))
+                   for i in sample)
+
+    def positions_batch() -> int:
+        return len(positions_etl._generate_positions_batch(impressions, avg_positions, position_seeds))
+
+    def distribute_clicks() -> int:
+        generated = 0
+        for i in sample:
+            start, end = offsets[i], offsets[i + 1]
+            pairs = list(zip(positions[start:end].tolist(), orders[start:end].tolist()))
+            generated += len(clicks_etl._distribute_clicks(int(row_ids[i]), int(clicks[i]), pairs,
+                                                           int(click_seeds[i])))
+        return generated
+
+    def distribute_clicks_batch() -> int:
+        return len(clicks_etl._distribute_clicks_batch(row_ids, clicks, offsets, positions, orders,
+                                                       click_seeds)[0])
+
+    def seeds() -> int:
+        return len(row_seeds(seed, 'positions', df))
+
+    return {
+        'positions_array': positions_array,
+        'positions_batch': positions_batch,
+        'distribute_clicks': distribute_clicks,
+        'distribute_clicks_batch': distribute_clicks_batch,
+        'row_seeds': seeds,
+    }
+
+
+def previous_results(path: Path) -> Dict[tuple, dict]:
+    """Последний результат для каждого сочетания бенчмарка, параметров и окружения"""
+    latest = {}
+    if not path.exists():
+        return latest
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            latest[history_key(entry['benchmark'], entry['params'], entry)] = entry
+    return latest
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарк генераторов позиций и кликов")
+    parser.add_argument('--rows', type=int, default=20000, help="строк в синтетической выборке")
+    parser.add_argument('--per-row-rows', type=int, default=2000,
+                        help="строк для построчных обёрток _generate_positions_array/_distribute_clicks")
+    parser.add_argument('--repeat', type=positive_int, default=5, help="повторов на бенчмарк")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', default=None, help="запустить только указанные бенчмарки")
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT, help="JSONL с историей результатов")
+    parser.add_argument('--no-save', action='store_true', help="не дописывать результаты в --output")
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help="допустимое замедление ns/строку относительно прошлого прогона, доля (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    df = make_dataset(args.rows, args.seed)
+    benchmarks = build_benchmarks(df, args.per_row_rows, args.seed)
+    if args.only:
+        unknown = set(args.only) - set(benchmarks)
+        if unknown:
+            parser.error(f"неизвестные бенчмарки: {', '.join(sorted(unknown))}")
+        benchmarks = {name: func for name, func in benchmarks.items() if name in args.only}
+
+    revision = git_revision()
+    history = previous_results(args.output)
+    env = environment()
+    params = {'rows': args.rows, 'per_row_rows': args.per_row_rows, 'seed': args.seed}
+
+    print(f"Выборка: {args.rows} строк, {int(df['impressions'].sum())} показов, {int(df['clicks'].sum())} кликов")
+    print(f"{'бенчмарк':<26}{'нс/строку':>12}{'медиана':>12}{'пик, Б/строку':>16}{'к прошлому':>12}")
+
+    entries = []
+    regressions = []
+    for name, func in benchmarks.items():
+        result = measure(func, args.repeat)
+        previous: Optional[dict] = history.get(history_key(name, params, env))
+        change = None
+        if previous and previous.get('ns_per_row'):
+            change = result['ns_per_row'] / previous['ns_per_row'] - 1
+            if args.max_regression is not None and change > args.max_regression:
+                regressions.append((name, previous.get('commit'), change))
+
+        print(f"{name:<26}{result['ns_per_row']:>12.1f}{result['ns_per_row_median']:>12.1f}"
+              f"{result['peak_alloc_bytes_per_row']:>16.1f}{'' if change is None else f'{change:+.1%}':>12}")
+        entries.append({
+            'benchmark': name,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            **revision,
+            **env,
+            'params': params,
+            **result,
+        })
+
+    if not args.no_save:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        print(f"Результаты дописаны в {args.output}")
+
+    for name, commit, change in regressions:
+        print(f"❌ {name}: медленнее на {change:.1%} относительно {commit}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
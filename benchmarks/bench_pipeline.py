@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Сквозной бенчмарк: сбор данных из локальной замены API и ETL в локальный Postgres.
+
+Поднимает benchmarks/fake_webmaster.py, направляет на него клиент через
+BASE_URL и по очереди запускает DataCollector.run_sync и
+ETLCoordinator.run_full_pipeline. Для каждой фазы печатает запросы/с,
+строки/с и пиковый RSS процесса; результат можно сохранить в JSON.
+
+Подключение к БД берется из DB_* (.env или окружение). --reset очищает
+rdl.webmaster и ppl.*, поэтому запускайте его только на локальной базе.
+
+    python benchmarks/bench_pipeline.py --urls 200 --queries 100 --days 7 --reset
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from benchmarks.fake_webmaster import FakeWebmasterServer, add_config_arguments, config_from_args
+
+# Данные, журналы загрузок и состояние ETL: после сброса пайплайн идет по
+# обычному пути, а не по первому запуску с регистрацией старых строк
+_RESET_TABLES = ('ppl.webmaster_clicks', 'ppl.webmaster_positions', 'ppl.webmaster_aggregated',
+                 'ppl.webmaster_aggregated_loads', 'ppl.etl_processed_loads', 'ppl.etl_state',
+                 'rdl.webmaster', 'rdl.webmaster_loads')
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса и его дочерних процессов (шарды ETL), МБ"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # В Linux ru_maxrss в КБ, в macOS — в байтах
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(max(own, children) / scale, 1)
+
+
+def reset_tables():
+    from sqlalchemy import text
+    from src.models.database import engine, AGGREGATED_ID_SEQUENCE
+
+    sequence = f"{AGGREGATED_ID_SEQUENCE.schema}.{AGGREGATED_ID_SEQUENCE.name}"
+    with engine.begin() as conn:
+        tables = [table for table in _RESET_TABLES
+                  if conn.execute(text("SELECT to_regclass(:name)"), {"name": table}).scalar()]
+        if tables:
+            conn.execute(text(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY"))
+        # Последовательность из create_tables() не принадлежит колонке, и RESTART IDENTITY ее не сбрасывает
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": sequence}).scalar():
+            conn.execute(text(f"ALTER SEQUENCE {sequence} RESTART"))
+
+
+def run_phase(name: str, func, server) -> dict:
+    requests_before = server.host.stats()['requests']
+    started = time.perf_counter()
+    rows = func()
+    elapsed = time.perf_counter() - started
+    api_requests = server.host.stats()['requests'] - requests_before
+    result = {
+        'phase': name,
+        'seconds': round(elapsed, 3),
+        'rows': rows,
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed else None,
+        'api_requests': api_requests,
+        'requests_per_sec': round(api_requests / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print(f"{name}: {rows} строк за {elapsed:.2f} с ({result['rows_per_sec']} строк/с), "
+          f"{api_requests} запросов ({result['requests_per_sec']} запросов/с), "
+          f"пиковый RSS {result['peak_rss_mb']} МБ")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк сбора и ETL")
+    add_config_arguments(parser)
+    parser.add_argument('--days-back', type=int, default=None,
+                        help="DAYS_BACK сборщика (по умолчанию равно --days)")
+    parser.add_argument('--skip-etl', action='store_true', help="только сбор данных")
+    parser.add_argument('--reset', action='store_true',
+                        help="очистить rdl.webmaster и ppl.* перед запуском (только локальная БД!)")
+    parser.add_argument('--output', type=Path, default=None, help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    with FakeWebmasterServer(config_from_args(args)) as server:
+        # Settings читает окружение при импорте, поэтому модули проекта импортируются после
+        os.environ.update({
+            'BASE_URL': server.base_url,
+            'API_TOKEN': 'benchmark',
+            'USER_ID': 'benchmark',
+            'HOST_ID': 'benchmark',
+            'DAYS_BACK': str(args.days_back or args.days),
+            'DATA_DIR': tempfile.mkdtemp(prefix='webmaster-bench-'),
+        })
+        from src.core.collector import DataCollector
+        from src.etl.coordinator import ETLCoordinator
+        from src.models.database import create_tables
+
+        create_tables()
+        if args.reset:
+            reset_tables()
+
+        results = [run_phase('collect', lambda: sum(DataCollector().run_sync().values()), server)]
+        if not args.skip_etl:
+            results.append(run_phase(
+                'etl', lambda: sum(ETLCoordinator().run_full_pipeline().values()), server
+            ))
+
+        summary = {
+            'config': vars(config_from_args(args)),
+            'api': server.host.stats(),
+            'phases': results,
+        }
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
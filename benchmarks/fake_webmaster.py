@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Локальная замена query-analytics/list API Яндекс.Вебмастера для бенчмарков.
+
+Сервер отдает синтетический хост: urls страниц, у каждой до queries запросов.
+Наличие строки и ее метрики детерминированно выводятся из хэша
+(дата, URL, запрос, устройство), поэтому повторные запросы и повторные
+запуски видят одни и те же данные. Задержка, доля ошибок 5xx и серии
+429 настраиваются, чтобы проверять повторы и ограничитель скорости.
+
+    python benchmarks/fake_webmaster.py --urls 200 --queries 100 --latency 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+DEVICES = ('DESKTOP', 'MOBILE', 'TABLET')
+# Доля пар запрос × устройство, по которым есть спрос
+DEVICE_SHARE = {'DESKTOP': 0.7, 'MOBILE': 0.6, 'TABLET': 0.15}
+
+_PATH = re.compile(r'^/v4/user/[^/]+/hosts/[^/]+/query-analytics/list$')
+
+
+@dataclass
+class FakeHostConfig:
+    urls: int = 100
+    queries: int = 50
+    days: int = 30
+    latency: float = 0.0
+    error_rate: float = 0.0
+    # Каждые burst_every запросов следующие burst_length получают 429
+    burst_every: int = 0
+    burst_length: int = 0
+    retry_after: float = 0.0
+    seed: int = 0
+
+
+class FakeWebmasterHost:
+    """Синтетические данные и счетчики запросов"""
+
+    def __init__(self, config: FakeHostConfig):
+        self.config = config
+        self.urls = [f"https://example.com/page/{i}" for i in range(config.urls)]
+        self.queries = [f"query {i}" for i in range(config.queries)]
+        self.last_date = date.today()
+        self.first_date = self.last_date - timedelta(days=config.days - 1)
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0}
+        self.rng = random.Random(config.seed)
+        self._url_cache: Dict[Tuple[str, Optional[str]], List[str]] = {}
+
+    def _hash(self, *parts) -> int:
+        key = '\x1f'.join(str(p) for p in (self.config.seed,) + parts).encode()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+    def _metrics(self, day: str, url: str, query: str, device: str) -> Optional[Dict[str, float]]:
+        h = self._hash(day, url, query, device)
+        if (h % 10000) / 10000 >= DEVICE_SHARE[device]:
+            return None
+        demand = 1 + (h >> 16) % 200
+        impressions = (h >> 24) % (demand + 1)
+        clicks = (h >> 32) % (impressions + 1) if impressions else 0
+        position = round(1 + ((h >> 40) % 500) / 10, 1) if impressions else 0.0
+        return {'DEMAND': demand, 'IMPRESSIONS': impressions, 'CLICKS': clicks, 'POSITION': position}
+
+    def _has_date(self, day: str) -> bool:
+        return self.first_date.isoformat() <= day <= self.last_date.isoformat()
+
+    def _devices(self, device: Optional[str]) -> Tuple[str, ...]:
+        return (device,) if device else DEVICES
+
+    def _urls_with_data(self, day: str, device: Optional[str]) -> List[str]:
+        key = (day, device)
+        if key not in self._url_cache:
+            self._url_cache[key] = [
+                url for url in self.urls
+                if any(self._metrics(day, url, query, d) for d in self._devices(device) for query in self.queries)
+            ] if self._has_date(day) else []
+        return self._url_cache[key]
+
+    @staticmethod
+    def _statistics(day: str, metrics: Dict[str, float]) -> List[Dict[str, Any]]:
+        return [{'date': day, 'field': field, 'value': value} for field, value in metrics.items()]
+
+    def query_analytics(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        filters = payload.get('filters', {})
+        statistic_filter = (filters.get('statistic_filters') or [{}])[0]
+        day = statistic_filter.get('from', '')
+        device = payload.get('device_type_indicator')
+        offset = int(payload.get('offset', 0))
+        limit = int(payload.get('limit', 500))
+
+        if payload.get('text_indicator') == 'URL':
+            items = [{'text_indicator': {'type': 'URL', 'value': url}, 'statistics': []}
+                     for url in self._urls_with_data(day, device)]
+        else:
+            text_filters = filters.get('text_filters') or []
+            urls = [f['value'] for f in text_filters if f.get('text_indicator') == 'URL'] or self.urls
+            items = []
+            for url in (urls if self._has_date(day) else []):
+                for query in self.queries:
+                    for d in self._devices(device):
+                        metrics = self._metrics(day, url, query, d)
+                        if metrics:
+                            items.append({'text_indicator': {'type': 'QUERY', 'value': query},
+                                          'statistics': self._statistics(day, metrics)})
+                            break
+                    if len(items) >= offset + limit:
+                        break
+                if len(items) >= offset + limit:
+                    break
+
+        return {'text_indicator_to_statistics': items[offset:offset + limit], 'count': len(items)}
+
+    def next_status(self) -> int:
+        """HTTP-статус очередного запроса с учетом серий 429 и случайных 5xx"""
+        config = self.config
+        with self.lock:
+            self.counters['requests'] += 1
+            n = self.counters['requests']
+            if config.burst_every and n > config.burst_every and (n - 1) % config.burst_every < config.burst_length:
+                self.counters['throttled'] += 1
+                return 429
+            if config.error_rate and self.rng.random() < config.error_rate:
+                self.counters['errors'] += 1
+                return 503
+            self.counters['ok'] += 1
+            return 200
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+
+def _make_handler(host: FakeWebmasterHost):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+
+            if not _PATH.match(self.path):
+                self._send(404, {'error_code': 'NOT_FOUND'})
+                return
+
+            if host.config.latency:
+                time.sleep(host.config.latency)
+
+            status = host.next_status()
+            if status == 429:
+                self._send(429, {'error_code': 'TOO_MANY_REQUESTS'},
+                           {'Retry-After': f"{host.config.retry_after:g}"})
+            elif status != 200:
+                self._send(status, {'error_code': 'INTERNAL_ERROR'})
+            else:
+                self._send(200, host.query_analytics(payload))
+
+    return Handler
+
+
+class FakeWebmasterServer:
+    """HTTP-сервер в фоновом потоке; base_url подставляется в BASE_URL клиента"""
+
+    def __init__(self, config: FakeHostConfig, port: int = 0):
+        self.host = FakeWebmasterHost(config)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _make_handler(self.host))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v4"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--urls', type=int, default=100, help="число страниц хоста")
+    parser.add_argument('--queries', type=int, default=50, help="число запросов на страницу")
+    parser.add_argument('--days', type=int, default=30, help="сколько последних дней есть данные")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунд")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument('--burst-every', type=int, default=0, help="период серий 429, запросов")
+    parser.add_argument('--burst-length', type=int, default=0, help="длина серии 429, запросов")
+    parser.add_argument('--retry-after', type=float, default=0.0, help="Retry-After в ответах 429, секунд")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def config_from_args(args) -> FakeHostConfig:
+    return FakeHostConfig(
+        urls=args.urls, queries=args.queries, days=args.days, latency=args.latency,
+        error_rate=args.error_rate, burst_every=args.burst_every, burst_length=args.burst_length,
+        retry_after=args.retry_after, seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Webmaster API")
+    parser.add_argument('--port', type=int, default=8080)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    with FakeWebmasterServer(config_from_args(args), port=args.port) as server:
+        print(f"Fake Webmaster API: {server.base_url}")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            print(f"\nЗапросов: {server.host.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@ from pathlib import Path
 from dotenv import load_dotenv
 
 # Загружаем .env файл
-env_path = Path(__file__).parent.parent / '.env'
+BASE_DIR = Path(__file__).parent.parent
+env_path = BASE_DIR / '.env'
 load_dotenv(env_path)
 
 class Settings:
@@ -21,11 +22,38 @@ class Settings:
     BASE_URL = os.getenv('BASE_URL', 'https://api.webmaster.yandex.net/v4')
     USER_ID = os.getenv('USER_ID', '')
     HOST_ID = os.getenv('HOST_ID', '')
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+    API_CONCURRENCY = int(os.getenv('API_CONCURRENCY', HTTP_POOL_SIZE))
+    API_TIMEOUT = float(os.getenv('API_TIMEOUT', 30))
+    API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', 10))
+    API_BURST = int(os.getenv('API_BURST', 10))
+    API_MAX_RETRIES = int(os.getenv('API_MAX_RETRIES', 5))
+    API_BACKOFF_BASE = float(os.getenv('API_BACKOFF_BASE', 1.0))
+    API_BACKOFF_MAX = float(os.getenv('API_BACKOFF_MAX', 60.0))
     
     # App
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_SERIALIZE = os.getenv('LOG_SERIALIZE', 'false').lower() in ('1', 'true', 'yes')
+    PROGRESS_EVERY = int(os.getenv('PROGRESS_EVERY', 100))
+    PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 10))
     DAYS_BACK = int(os.getenv('DAYS_BACK', 20))
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', 500))
+    FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 8))
+    EXTRACTION_STRATEGY = os.getenv('EXTRACTION_STRATEGY', 'cartesian')
+    BACKFILL_DATE_WORKERS = int(os.getenv('BACKFILL_DATE_WORKERS', 2))
+    DATA_DIR = Path(os.getenv('DATA_DIR', BASE_DIR / 'data'))
+    DATE_CACHE_TTL = int(os.getenv('DATE_CACHE_TTL', 6 * 3600))
+    RAW_ARCHIVE = os.getenv('RAW_ARCHIVE', 'false').lower() in ('1', 'true', 'yes')
+    METRICS_DIR = Path(os.getenv('METRICS_DIR', BASE_DIR / 'logs' / 'metrics'))
+    
+    # ETL
+    AGGREGATION_MODE = os.getenv('AGGREGATION_MODE', 'pandas')
+    COPY_BATCH_SIZE = int(os.getenv('COPY_BATCH_SIZE', 100000))
+    ETL_STREAMING = os.getenv('ETL_STREAMING', 'false').lower() in ('1', 'true', 'yes')
+    ETL_CHUNK_SIZE = int(os.getenv('ETL_CHUNK_SIZE', 50000))
+    ETL_SHARDS = int(os.getenv('ETL_SHARDS', 1))
+    GENERATOR_SEED = int(os.getenv('GENERATOR_SEED', 0))
+    PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 2))
     
     @property
     def db(self):
@@ -42,14 +70,39 @@ class Settings:
             base_url = Settings.BASE_URL
             user_id = Settings.USER_ID
             host_id = Settings.HOST_ID
+            pool_size = Settings.HTTP_POOL_SIZE
+            concurrency = Settings.API_CONCURRENCY
+            timeout = Settings.API_TIMEOUT
+            rate_limit = Settings.API_RATE_LIMIT
+            burst = Settings.API_BURST
+            max_retries = Settings.API_MAX_RETRIES
+            backoff_base = Settings.API_BACKOFF_BASE
+            backoff_max = Settings.API_BACKOFF_MAX
         return API()
     
     @property
     def app(self):
         class App:
             log_level = Settings.LOG_LEVEL
+            log_serialize = Settings.LOG_SERIALIZE
+            progress_every = Settings.PROGRESS_EVERY
+            progress_interval = Settings.PROGRESS_INTERVAL
             days_back = Settings.DAYS_BACK
             batch_size = Settings.BATCH_SIZE
+            fetch_workers = Settings.FETCH_WORKERS
+            extraction_strategy = Settings.EXTRACTION_STRATEGY
+            backfill_date_workers = Settings.BACKFILL_DATE_WORKERS
+            data_dir = Settings.DATA_DIR
+            date_cache_ttl = Settings.DATE_CACHE_TTL
+            raw_archive = Settings.RAW_ARCHIVE
+            metrics_dir = Settings.METRICS_DIR
+            aggregation_mode = Settings.AGGREGATION_MODE
+            copy_batch_size = Settings.COPY_BATCH_SIZE
+            etl_streaming = Settings.ETL_STREAMING
+            etl_chunk_size = Settings.ETL_CHUNK_SIZE
+            etl_shards = Settings.ETL_SHARDS
+            generator_seed = Settings.GENERATOR_SEED
+            partition_months_ahead = Settings.PARTITION_MONTHS_AHEAD
         return App()
 
 settings = Settings()
\ No newline at end of file
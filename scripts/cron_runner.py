@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Скрипт для запуска через cron"""
 
+import argparse
 import sys
 from pathlib import Path
 
@@ -9,10 +10,20 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from src.core.collector import DataCollector
 from src.utils.logger import setup_logger
+from src.utils.metrics import write_run_metrics
+from src.utils.profiling import add_profile_argument, profiled
+from src.models.database import create_tables
 from datetime import datetime
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Синхронизация по cron")
+    add_profile_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Основная функция для cron"""
+    args = parse_args(argv)
+    
     # Настройка логирования
     setup_logger()
     
@@ -22,11 +33,17 @@ def main():
     print(f"{'='*60}\n")
     
     try:
+        # Схемы, индексы и секции на ближайшие месяцы
+        created = create_tables()
+        if created:
+            print(f"Созданы секции: {', '.join(created)}")
+        
         # Создаем сборщик
         collector = DataCollector()
         
         # Запускаем синхронизацию
-        results = collector.run_sync()
+        with profiled('collector', args.profile):
+            results = collector.run_sync()
         
         # Выводим итоги
         total_records = sum(results.values())
@@ -42,6 +59,8 @@ def main():
         import traceback
         traceback.print_exc()
         return 1
+    finally:
+        print(f"Метрики запуска: {write_run_metrics('collector')}")
 
 if __name__ == "__main__":
     sys.exit(main())
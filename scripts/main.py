@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import sys
 from pathlib import Path
 
@@ -6,21 +7,56 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from src.core.collector import DataCollector
+from src.utils.logger import setup_logger
+from src.utils.metrics import write_run_metrics
+from src.utils.profiling import add_profile_argument, profiled
+from src.models.database import create_tables
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сбор данных Яндекс.Вебмастер")
+    parser.add_argument('--backfill', nargs=2, metavar=('START', 'END'),
+                        help="загрузить диапазон дат YYYY-MM-DD (включительно) вместо последних DAYS_BACK дней")
+    parser.add_argument('--replay', nargs='*', metavar='DATE',
+                        help="перезалить rdl.webmaster из архива data/raw без API: все даты или START END")
+    parser.add_argument('--date-workers', type=int, default=None,
+                        help="сколько дат бэкфилла загружать параллельно (по умолчанию BACKFILL_DATE_WORKERS)")
+    add_profile_argument(parser)
+    args = parser.parse_args(argv)
+    if args.replay is not None and len(args.replay) not in (0, 2):
+        parser.error("--replay принимает либо ноль, либо две даты")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    # Настройка логирования: сообщения модулей идут через очередь в фоновый поток
+    setup_logger()
+    
     print("=" * 60)
     print("СБОР ДАННЫХ ЯНДЕКС.ВЕБМАСТЕР (ООП версия)")
     print("=" * 60)
     
     try:
+        # Журнал загрузок rdl.webmaster_loads пишется вместе с данными, поэтому нужен до сбора
+        created = create_tables()
+        if created:
+            print(f"Созданы секции: {', '.join(created)}")
+        
         collector = DataCollector()
         
         if not collector.test_connection():
             print("❌ Ошибка подключения")
             return 1
         
-        results = collector.run_sync()
+        with profiled('collector', args.profile):
+            if args.replay is not None:
+                results = collector.run_replay(*args.replay)
+            elif args.backfill:
+                results = collector.run_backfill(*args.backfill, date_workers=args.date_workers)
+            else:
+                results = collector.run_sync()
         
         total = sum(results.values())
         print(f"\nИтог: загружено {total} записей")
@@ -34,6 +70,8 @@ def main():
         import traceback
         traceback.print_exc()
         return 1
+    finally:
+        print(f"Метрики запуска: {write_run_metrics('collector')}")
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Точка входа для запуска ETL пайплайна"""
 
+import argparse
 import sys
 from pathlib import Path
 
@@ -9,10 +10,26 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from src.etl.coordinator import ETLCoordinator
 from src.utils.logger import setup_logger
+from src.utils.metrics import write_run_metrics
+from src.utils.profiling import add_profile_argument, profiled
+from src.models.database import create_tables
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ETL пайплайн RDL → PPL")
+    add_profile_argument(parser)
+    parser.add_argument('--profile-stage', choices=('aggregated', 'positions', 'clicks'), default=None,
+                        help="профилировать только этот этап вместо всего пайплайна")
+    args = parser.parse_args(argv)
+    if args.profile_stage and not args.profile:
+        parser.error("--profile-stage требует --profile")
+    return args
+
+
+def main(argv=None):
     """Основная функция"""
+    args = parse_args(argv)
+    
     # Настройка логирования
     setup_logger()
     
@@ -21,11 +38,17 @@ def main():
     print("=" * 60)
     
     try:
+        # Схемы, индексы и секции на ближайшие месяцы
+        created = create_tables()
+        if created:
+            print(f"Созданы секции: {', '.join(created)}")
+        
         # Создаем координатор
-        coordinator = ETLCoordinator()
+        coordinator = ETLCoordinator(profile_mode=args.profile, profile_stage=args.profile_stage)
         
-        # Запускаем полный пайплайн
-        results = coordinator.run_full_pipeline()
+        # Запускаем полный пайплайн (целиком под профайлером, если этап не выбран)
+        with profiled('etl', None if args.profile_stage else args.profile):
+            results = coordinator.run_full_pipeline()
         
         # Проверяем согласованность
         coordinator.check_data_consistency()
@@ -41,6 +64,8 @@ def main():
         import traceback
         traceback.print_exc()
         return 1
+    finally:
+        print(f"Метрики запуска: {write_run_metrics('etl')}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+
+
+class TokenBucket:
+    """Адаптивный token bucket для запросов к API.
+
+    Скорость пополнения снижается вдвое при каждом 429/5xx и плавно
+    возвращается к максимальной после успешных ответов, поэтому поток
+    запросов держится чуть ниже квоты API.
+    """
+
+    def __init__(self, rate: float, capacity: int, min_rate: float = 0.5):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate) if rate > 0 else 0.0
+        self.capacity = max(1, int(capacity))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Блокирует поток до получения токена. rate <= 0 отключает лимит"""
+        if self.max_rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self):
+        """Мультипликативное снижение скорости после 429/5xx"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            self.throttled += 1
+
+    def on_success(self):
+        """Аддитивное восстановление скорости после успешного ответа"""
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def limits(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'rate': round(self.rate, 3),
+                'max_rate': self.max_rate,
+                'capacity': self.capacity,
+                'throttled': self.throttled
+            }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """Экспоненциальная задержка с full jitter; Retry-After задает нижнюю границу"""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
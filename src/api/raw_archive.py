@@ -0,0 +1,104 @@
+import gzip
+import json
+import struct
+import threading
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+from loguru import logger
+
+# Заголовок записи: длина gzip-члена в байтах
+_HEADER = struct.Struct('>I')
+
+
+class RawArchive:
+    """Архив сырых ответов API в data/raw (только дозапись).
+
+    Ответы пишутся в <root>/<endpoint>/<date>.jsonl.gz: одна строка на
+    ответ с ключом endpoint/date/url/device. Каждая запись — отдельный
+    gzip-член с префиксом длины, поэтому дозапись не переписывает файл,
+    а испорченная запись пропускается при чтении, не задевая соседние.
+    Запись, оборванная при аварийной остановке, обрезается перед первой
+    дозаписью в файл.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.lock = threading.Lock()
+        # Файлы, хвост которых уже проверен этим экземпляром
+        self._checked = set()
+
+    def _path(self, endpoint: str, target_date: str) -> Path:
+        return self.root / endpoint / f"{target_date}.jsonl.gz"
+
+    def append(self, endpoint: str, target_date: str, response: Dict[str, Any],
+               url: str = None, device: str = None, offset: int = 0):
+        entry = {
+            'endpoint': endpoint,
+            'date': target_date,
+            'url': url,
+            'device': device,
+            'offset': offset,
+            'fetched_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'response': response
+        }
+        data = gzip.compress((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+        path = self._path(endpoint, target_date)
+        with self.lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if path not in self._checked:
+                self._repair_tail(path)
+                self._checked.add(path)
+            with open(path, 'ab') as f:
+                f.write(_HEADER.pack(len(data)) + data)
+
+    @staticmethod
+    def _repair_tail(path: Path):
+        """Обрезает запись, оборванную при аварийной остановке, чтобы дозапись не сбила разметку"""
+        if not path.exists():
+            return
+        size = path.stat().st_size
+        end = 0
+        with open(path, 'rb') as f:
+            while end + _HEADER.size <= size:
+                f.seek(end)
+                length, = _HEADER.unpack(f.read(_HEADER.size))
+                if end + _HEADER.size + length > size:
+                    break
+                end += _HEADER.size + length
+        if end < size:
+            logger.warning(f"Архив {path}: обрезана оборванная запись ({size - end} байт)")
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+
+    def dates(self, endpoint: str) -> List[str]:
+        """Даты, по которым в архиве есть ответы endpoint"""
+        return sorted(path.name[:-len('.jsonl.gz')] for path in (self.root / endpoint).glob('*.jsonl.gz'))
+
+    def read(self, endpoint: str, target_date: str) -> Iterator[Dict[str, Any]]:
+        """Записи архива за дату в порядке записи; испорченные записи пропускаются"""
+        path = self._path(endpoint, target_date)
+        if not path.exists():
+            return
+        with open(path, 'rb') as f:
+            index = 0
+            while True:
+                header = f.read(_HEADER.size)
+                if not header:
+                    return
+                data = None
+                if len(header) == _HEADER.size:
+                    length, = _HEADER.unpack(header)
+                    data = f.read(length)
+                if data is None or len(data) < length:
+                    # Запись, оборванная при аварийной остановке, — конец архива
+                    logger.warning(f"Архив {path}: запись {index} оборвана, чтение остановлено")
+                    return
+                try:
+                    entry = json.loads(gzip.decompress(data))
+                except (EOFError, ValueError, OSError, zlib.error) as e:
+                    logger.warning(f"Архив {path}: запись {index} пропущена: {e}")
+                else:
+                    yield entry
+                index += 1
@@ -1,15 +1,63 @@
 import requests
-from typing import List, Dict, Any
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from datetime import datetime
+import threading
+import time
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from config.settings import settings
+from src.api.rate_limiter import TokenBucket, backoff_delay, parse_retry_after
+from src.api.raw_archive import RawArchive
+from src.utils.metrics import metrics
+
+
+class WebmasterAPIError(Exception):
+    """Запрос к API не удался после всех повторов"""
+
+
+# Сетевые ошибки и оборванные ответы, после которых запрос повторяется
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError)
+
+
+def parse_query_rows(stats_list: List[Dict[str, Any]], target_date: str,
+                     page_url: str, device: str) -> List[Dict[str, Any]]:
+    """Строки rdl.webmaster из ответа query-analytics за дату.
+
+    Общий разбор для загрузки из API и для перезаливки из архива data/raw.
+    """
+    data_rows = []
+    row_date = datetime.strptime(target_date, '%Y-%m-%d').date()
+
+    for item in stats_list:
+        query_text = item.get('text_indicator', {}).get('value', 'N/A')
+        metrics = {}
+        for stat in item.get('statistics', []):
+            if stat.get('date') == target_date:
+                metrics[stat.get('field')] = stat.get('value', 0)
+
+        if metrics.get('DEMAND', 0) > 0:
+            data_rows.append({
+                'date': row_date,
+                'page_path': page_url,
+                'query': query_text,
+                'demand': int(metrics.get('DEMAND', 0)),
+                'impressions': int(float(metrics.get('IMPRESSIONS', 0))),
+                'clicks': int(float(metrics.get('CLICKS', 0))),
+                'position': float(metrics.get('POSITION', 0)),
+                'device': device.lower()
+            })
+
+    return data_rows
 
 
 class WebmasterClient:
     def __init__(self):
+        self.logger = logger
         self.base_url = settings.api.base_url
         self.headers = {
             'Authorization': f'OAuth {settings.api.token}',
@@ -17,6 +65,97 @@ class WebmasterClient:
         }
         self.user_id = settings.api.user_id
         self.host_id = settings.api.host_id
+        self.session = self._create_session(settings.api.pool_size)
+        self.timeout = settings.api.timeout
+        self.max_retries = settings.api.max_retries
+        self.backoff_base = settings.api.backoff_base
+        self.backoff_max = settings.api.backoff_max
+        self.rate_limiter = TokenBucket(settings.api.rate_limit, settings.api.burst)
+        # Общий бюджет одновременных запросов для всех потоков, использующих клиент
+        self.concurrency = threading.BoundedSemaphore(max(1, settings.api.concurrency))
+        self.archive = RawArchive(settings.app.data_dir / 'raw') if settings.app.raw_archive else None
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """Создает сессию с пулом keep-alive соединений.
+
+        pool_block=True не дает открыть больше pool_size соединений:
+        лишние потоки ждут свободное соединение вместо нового handshake.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _post(self, url: str, payload: Dict[str, Any]) -> requests.Response:
+        """POST с лимитом скорости и повторами на 429/5xx и сетевых ошибках.
+
+        Любая ошибка requests выходит отсюда как WebmasterAPIError.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                with self.concurrency:
+                    response = self.session.post(url, headers=self.headers, json=payload, timeout=self.timeout)
+            except TRANSIENT_ERRORS as e:
+                metrics.observe('api_request_seconds', time.perf_counter() - started, status='error')
+                reason = str(e)
+            except requests.RequestException as e:
+                # Ошибка запроса, которую повтор не исправит: падает только текущая дата
+                metrics.observe('api_request_seconds', time.perf_counter() - started, status='error')
+                raise WebmasterAPIError(f"{type(e).__name__}: {e}") from e
+            else:
+                metrics.observe('api_request_seconds', time.perf_counter() - started, status=response.status_code)
+                metrics.inc('api_response_bytes_total', len(response.content))
+                if response.status_code != 429 and response.status_code < 500:
+                    self.rate_limiter.on_success()
+                    return response
+                self.rate_limiter.on_throttle()
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                reason = f"HTTP {response.status_code}"
+
+            if attempt >= self.max_retries:
+                raise WebmasterAPIError(f"{reason} после {attempt + 1} попыток")
+
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+            metrics.inc('api_retries_total')
+            self.logger.warning(f"Повтор запроса через {delay:.1f} с ({reason})")
+            time.sleep(delay)
+            attempt += 1
+
+    def _post_json(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = self._post(url, payload)
+        if response.status_code != 200:
+            raise WebmasterAPIError(f"HTTP {response.status_code}: {response.text[:200]}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise WebmasterAPIError(f"Ответ не JSON: {response.text[:200]}") from e
+
+    def limits(self) -> Dict[str, Any]:
+        """Текущие параметры ограничителя скорости"""
+        return self.rate_limiter.limits()
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Счетчики переиспользования соединений по всем пулам сессии"""
+        stats = {'requests': 0, 'connections': 0, 'reused': 0}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+        stats['reused'] = max(0, stats['requests'] - stats['connections'])
+        return stats
+
+    def close(self):
+        self.session.close()
 
     def check_date_has_data(self, target_date: str) -> bool:
         url = f'{self.base_url}/user/{self.user_id}/hosts/{self.host_id}/query-analytics/list'
@@ -34,17 +173,12 @@ class WebmasterClient:
             }
         }
 
-        try:
-            response = requests.post(url, headers=self.headers, json=payload)
-            if response.status_code == 200:
-                data = response.json()
-                return len(data.get('text_indicator_to_statistics', [])) > 0
-            return False
-        except:
-            return False
+        data = self._post_json(url, payload)
+        return len(data.get('text_indicator_to_statistics', [])) > 0
     
-    def get_urls_for_date(self, target_date: str) -> List[str]:
-        """Получает все уникальные URL для указанной даты"""
+    def get_urls_for_date(self, target_date: str, device: Optional[str] = None,
+                          statistic_field: str = "IMPRESSIONS") -> List[str]:
+        """Получает все уникальные URL для указанной даты (и устройства)"""
         url = f'{self.base_url}/user/{self.user_id}/hosts/{self.host_id}/query-analytics/list'
         urls = set()
         offset = 0
@@ -57,7 +191,7 @@ class WebmasterClient:
                 "text_indicator": "URL",
                 "filters": {
                     "statistic_filters": [{
-                        "statistic_field": "IMPRESSIONS",
+                        "statistic_field": statistic_field,
                         "operation": "GREATER_THAN",
                         "value": "0",
                         "from": target_date,
@@ -65,81 +199,95 @@ class WebmasterClient:
                     }]
                 }
             }
+            if device:
+                payload["device_type_indicator"] = device
             
-            try:
-                response = requests.post(url, headers=self.headers, json=payload)
-                if response.status_code == 200:
-                    data = response.json()
-                    stats_list = data.get('text_indicator_to_statistics', [])
-                    
-                    if not stats_list:
-                        break
-                    
-                    for item in stats_list:
-                        url_value = item.get('text_indicator', {}).get('value', '')
-                        if url_value and url_value != 'N/A':
-                            urls.add(url_value)
-                    
-                    if len(stats_list) < limit:
-                        break
-                        
-                    offset += limit
-                else:
-                    print(f"Ошибка при получении URL за {target_date}: {response.status_code}")
-                    break
-            except Exception as e:
-                print(f"Ошибка при получении URL: {e}")
+            # Ошибку пробрасываем: неполный список URL хуже, чем повтор даты
+            data = self._post_json(url, payload)
+            if self.archive is not None:
+                self.archive.append('urls', target_date, data, device=device, offset=offset)
+            stats_list = data.get('text_indicator_to_statistics', [])
+            
+            if not stats_list:
                 break
+            
+            for item in stats_list:
+                url_value = item.get('text_indicator', {}).get('value', '')
+                if url_value and url_value != 'N/A':
+                    urls.add(url_value)
+            
+            if len(stats_list) < limit:
+                break
+                
+            offset += limit
         
         return list(urls)
 
-    def get_queries_for_url_and_date(self, target_date: str, page_url: str, device: str) -> List[Dict[str, Any]]:
+    def get_url_device_pairs(self, target_date: str, devices: List[str]) -> List[Tuple[str, str]]:
+        """Пары URL × устройство, по которым за дату есть спрос.
+
+        query-analytics/list группирует статистику только по одному текстовому
+        индикатору (QUERY или URL), поэтому пары запрос × URL за один проход
+        получить нельзя. Вместо этого URL запрашиваются постранично отдельно
+        для каждого устройства с тем же фильтром DEMAND > 0, что и у запросов
+        по URL, и дальше опрашиваются только непустые пары.
+        """
+        pairs = []
+        for device in devices:
+            for page_url in self.get_urls_for_date(target_date, device=device, statistic_field="DEMAND"):
+                pairs.append((page_url, device))
+        return pairs
+
+    def iter_query_pages(self, target_date: str, page_url: str, device: str) -> Iterator[List[Dict[str, Any]]]:
+        """Постранично отдает запросы по URL и устройству.
+
+        Каждая страница — список уже разобранных строк; в памяти держится
+        только текущая страница, сколько бы запросов ни было у URL.
+        """
         url = f'{self.base_url}/user/{self.user_id}/hosts/{self.host_id}/query-analytics/list'
-        payload = {
-            "limit": 500,
-            "text_indicator": "QUERY",
-            "device_type_indicator": device,
-            "filters": {
-                "text_filters": [{
-                    "text_indicator": "URL",
-                    "operation": "TEXT_MATCH",
-                    "value": page_url
-                }],
-                "statistic_filters": [{
-                    "statistic_field": "DEMAND",
-                    "operation": "GREATER_THAN",
-                    "value": "0",
-                    "from": target_date,
-                    "to": target_date
-                }]
+        offset = 0
+        limit = 500
+
+        while True:
+            payload = {
+                "offset": offset,
+                "limit": limit,
+                "text_indicator": "QUERY",
+                "device_type_indicator": device,
+                "filters": {
+                    "text_filters": [{
+                        "text_indicator": "URL",
+                        "operation": "TEXT_MATCH",
+                        "value": page_url
+                    }],
+                    "statistic_filters": [{
+                        "statistic_field": "DEMAND",
+                        "operation": "GREATER_THAN",
+                        "value": "0",
+                        "from": target_date,
+                        "to": target_date
+                    }]
+                }
             }
-        }
 
-        data_rows = []
+            data = self._post_json(url, payload)
+            if self.archive is not None:
+                self.archive.append('queries', target_date, data, url=page_url, device=device, offset=offset)
+            stats_list = data.get('text_indicator_to_statistics', [])
 
-        try:
-            response = requests.post(url, headers=self.headers, json=payload)
-            if response.status_code == 200:
-                data = response.json()
-                for item in data.get('text_indicator_to_statistics', []):
-                    query_text = item.get('text_indicator', {}).get('value', 'N/A')
-                    metrics = {}
-                    for stat in item.get('statistics', []):
-                        if stat.get('date') == target_date:
-                            metrics[stat.get('field')] = stat.get('value', 0)
-
-                    if metrics.get('DEMAND', 0) > 0:
-                        data_rows.append({
-                            'date': datetime.strptime(target_date, '%Y-%m-%d').date(),
-                            'page_path': page_url,
-                            'query': query_text,
-                            'demand': int(metrics.get('DEMAND', 0)),
-                            'impressions': int(float(metrics.get('IMPRESSIONS', 0))),
-                            'clicks': int(float(metrics.get('CLICKS', 0))),
-                            'position': float(metrics.get('POSITION', 0)),
-                            'device': device.lower()
-                        })
-        except Exception as e:
-            print(f"Error: {e}")
+            if not stats_list:
+                break
+
+            yield parse_query_rows(stats_list, target_date, page_url, device)
+
+            if len(stats_list) < limit:
+                break
+
+            offset += limit
 
+    def get_queries_for_url_and_date(self, target_date: str, page_url: str, device: str) -> List[Dict[str, Any]]:
+        """Все запросы по URL и устройству одним списком (все страницы)"""
+        data_rows = []
+        for rows in self.iter_query_pages(target_date, page_url, device):
+            data_rows.extend(rows)
         return data_rows
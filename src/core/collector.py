@@ -1,38 +1,146 @@
+from typing import List
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
 from pathlib import Path
+from loguru import logger
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from src.api.webmaster_client import WebmasterClient
+from src.api.webmaster_client import WebmasterClient, WebmasterAPIError
 from src.services.date_manager import DateManager
 from src.services.data_loader import DataLoader
+from src.services.checkpoint import BackfillCheckpoint
+from config.settings import settings
+from src.models.database import ensure_partitions
+from src.utils.metrics import metrics
+from src.utils.logger import ProgressReporter
 
 
 class DataCollector:
     def __init__(self):
-        print("Инициализация сборщика данных...")
+        self.logger = logger
+        self.logger.info("Инициализация сборщика данных...")
         self.client = WebmasterClient()
         self.date_manager = DateManager(self.client)
         self.loader = DataLoader(self.client)
-        print("Сборщик готов")
+        self.logger.info("Сборщик готов")
     
     def run_sync(self) -> dict:
-        print("Запуск синхронизации...")
+        self.logger.info("Запуск синхронизации...")
         
         # Получаем недостающие даты
         missing_dates = self.date_manager.get_missing_dates()
-        print(f"Найдено недостающих дат: {len(missing_dates)}")
+        self.logger.info(f"Найдено недостающих дат: {len(missing_dates)}")
         
         # Загружаем данные
         results = {}
         for date_str in missing_dates:
-            print(f"Обработка даты: {date_str}")
-            records_count = self.loader.load_data_for_date(date_str)
+            self.logger.info(f"Обработка даты: {date_str}")
+            # Отметка до первой вставки: сохраненные пары не должны делать дату загруженной
+            self.date_manager.incomplete.add(date_str)
+            try:
+                with metrics.timer('collector_date', mode='sync') as timing:
+                    records_count = timing.rows = self.loader.load_data_for_date(date_str)
+            except WebmasterAPIError as e:
+                # Дата остается незавершенной и повторяется целиком при следующем запуске;
+                # уже сохраненные строки пропустит ON CONFLICT
+                self.logger.error(f"Ошибка API за {date_str}: {e}")
+                continue
+            if self.loader.save_errors == 0:
+                self.date_manager.incomplete.discard(date_str)
+            else:
+                self.logger.warning(f"Дата {date_str} сохранена не полностью и будет повторена")
             results[date_str] = records_count
         
+        self.logger.info(f"Лимиты API: {self.client.limits()}")
         return results
     
+    def run_backfill(self, start_date: str, end_date: str, date_workers: int = None) -> dict:
+        """Загрузка диапазона дат [start_date, end_date] с несколькими датами параллельно.
+
+        Все даты делят один клиент, поэтому суммарное число запросов к API
+        ограничено API_CONCURRENCY и общим лимитом скорости. Прогресс пишется
+        в data/processed/backfill_<start>_<end>.jsonl; повторный запуск с тем же
+        диапазоном продолжает с места остановки.
+        """
+        date_workers = date_workers or settings.app.backfill_date_workers
+        dates = self._date_range(start_date, end_date)
+        self.logger.info(f"Бэкфилл {start_date} — {end_date}: {len(dates)} дат, {date_workers} параллельно")
+        
+        checkpoint = BackfillCheckpoint(
+            settings.app.data_dir / 'processed' / f'backfill_{start_date}_{end_date}.jsonl'
+        )
+        
+        # Даты, загруженные обычной синхронизацией до бэкфилла, тоже пропускаем
+        existing_dates = (self.date_manager.get_existing_dates(since=dates[0])
+                          - checkpoint.started_dates() - self.date_manager.incomplete.all())
+        pending = [d for d in dates if d not in checkpoint.done_dates and d not in existing_dates]
+        self.logger.info(f"Уже загружено: {len(dates) - len(pending)}, осталось: {len(pending)}")
+        
+        created = ensure_partitions(start=datetime.strptime(start_date, '%Y-%m-%d').date())
+        if created:
+            self.logger.info(f"Созданы секции: {', '.join(created)}")
+        
+        results = {}
+        progress = ProgressReporter("Бэкфилл: даты", total=len(pending), every=1)
+        with ThreadPoolExecutor(max_workers=max(1, date_workers)) as executor:
+            futures = {executor.submit(self._backfill_date, d, checkpoint): d for d in pending}
+            for future in as_completed(futures):
+                date_str = futures[future]
+                records_count = future.result()
+                if records_count is not None:
+                    results[date_str] = records_count
+                progress.update(rows=records_count or 0)
+        progress.finish()
+        
+        self.logger.info(f"Лимиты API: {self.client.limits()}")
+        return results
+    
+    def run_replay(self, start_date: str = None, end_date: str = None) -> dict:
+        """Перезаливка rdl.webmaster из архива data/raw за диапазон дат (по умолчанию весь архив)"""
+        dates = self.loader.raw_archive.dates('queries')
+        if start_date:
+            dates = [d for d in dates if d >= start_date]
+        if end_date:
+            dates = [d for d in dates if d <= end_date]
+        self.logger.info(f"Replay из архива: {len(dates)} дат")
+        
+        if dates:
+            created = ensure_partitions(start=datetime.strptime(dates[0], '%Y-%m-%d').date())
+            if created:
+                self.logger.info(f"Созданы секции: {', '.join(created)}")
+        
+        results = {}
+        for date_str in dates:
+            with metrics.timer('collector_date', mode='replay') as timing:
+                results[date_str] = timing.rows = self.loader.replay_date(date_str)
+        return results
+    
+    def _backfill_date(self, date_str: str, checkpoint: BackfillCheckpoint):
+        # У DataLoader состояние одной даты, поэтому на каждую дату свой экземпляр
+        loader = DataLoader(self.client)
+        # Пока дата не загружена целиком, синхронизация тоже считает ее недостающей
+        self.date_manager.incomplete.add(date_str)
+        try:
+            with metrics.timer('collector_date', mode='backfill') as timing:
+                timing.rows = loader.load_data_for_date(date_str, checkpoint=checkpoint)
+            if loader.save_errors == 0:
+                self.date_manager.incomplete.discard(date_str)
+            return timing.rows
+        except WebmasterAPIError as e:
+            self.logger.error(f"Ошибка API за {date_str}: {e}")
+            return None
+    
+    @staticmethod
+    def _date_range(start_date: str, end_date: str) -> List[str]:
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        if start > end:
+            raise ValueError(f"Начало диапазона {start_date} позже конца {end_date}")
+        return [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+    
     def test_connection(self) -> bool:
-        print("Тест подключения к API...")
-        print(f"USER_ID: {self.client.user_id}")
-        print(f"HOST_ID: {self.client.host_id}")
+        self.logger.info("Тест подключения к API...")
+        self.logger.info(f"USER_ID: {self.client.user_id}")
+        self.logger.info(f"HOST_ID: {self.client.host_id}")
         return True
\ No newline at end of file
@@ -1,13 +1,14 @@
 import pandas as pd
 import numpy as np
-from typing import Tuple
+from typing import List, Tuple
 import sys
 from pathlib import Path
 from sqlalchemy import text  # Добавляем импорт
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from config.settings import settings
 from src.etl.base import BaseETL
-from src.models.database import get_db
+from src.models.database import get_db, AGGREGATED_ID_SEQUENCE
 
 
 class AggregatedETL(BaseETL):
@@ -17,35 +18,166 @@ class AggregatedETL(BaseETL):
         super().__init__()
         self.source_table = "rdl.webmaster"
         self.target_table = f"{self.schema}.webmaster_aggregated"
+        self.id_sequence = f"{AGGREGATED_ID_SEQUENCE.schema}.{AGGREGATED_ID_SEQUENCE.name}"
+        self.stage = 'aggregated'
+        self.loads_table = "rdl.webmaster_loads"
+        # Журнал, по которому новые строки находят генераторы позиций и кликов
+        self.target_loads_table = f"{self.schema}.webmaster_aggregated_loads"
+    
+    def _ensure_id_sequence(self, db):
+        """Создает последовательность для id, если ее еще нет.
+
+        create_tables() создает ее вместе с новой таблицей; здесь она нужна
+        таблицам, созданным раньше. Последовательность стартует после уже
+        загруженных строк и становится DEFAULT для колонки id. Advisory lock
+        не дает двум загрузкам создать ее одновременно.
+        """
+        if db.execute(text("SELECT to_regclass(:name)"), {"name": self.id_sequence}).scalar():
+            return
+        
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": self.id_sequence})
+        if db.execute(text("SELECT to_regclass(:name)"), {"name": self.id_sequence}).scalar():
+            return
+        
+        self.logger.info(f"🔢 Создание последовательности {self.id_sequence}")
+        db.execute(text(f"CREATE SEQUENCE {self.id_sequence} OWNED BY {self.target_table}.id"))
+        db.execute(text(f"""
+            SELECT setval('{self.id_sequence}', COALESCE(MAX(id), 1), MAX(id) IS NOT NULL)
+            FROM {self.target_table}
+        """))
+        db.execute(text(f"""
+            ALTER TABLE {self.target_table} 
+            ALTER COLUMN id SET DEFAULT nextval('{self.id_sequence}')
+        """))
+    
+    def _reserve_ids(self, db, count: int) -> List[int]:
+        """Резервирует блок из count id в последовательности одним запросом"""
+        self._ensure_id_sequence(db)
+        result = db.execute(
+            text(f"SELECT nextval('{self.id_sequence}') FROM generate_series(1, :count)"),
+            {"count": count}
+        )
+        return [row[0] for row in result]
+    
+    def _bootstrap_watermark(self, db) -> dict:
+        """Первый запуск: все даты rdl.webmaster заносятся в журнал загрузок.
+
+        Строки, уже перенесенные в целевую таблицу, отсеет сравнение по
+        натуральному ключу, поэтому первый запуск один раз проверяет всю историю.
+        """
+        db.execute(text(f"INSERT INTO {self.loads_table} (date) SELECT DISTINCT date FROM {self.source_table}"))
+        max_date = db.execute(text(f"SELECT MAX(date) FROM {self.target_table}")).scalar()
+        return {'last_date': max_date}
+    
+    def _chunk_watermark(self, chunk) -> dict:
+        return {'last_date': chunk['date'].max()}
+    
+    def _extract_params(self) -> dict:
+        """Даты необработанных загрузок rdl.webmaster"""
+        return {"dates": sorted({load['date'] for load in self.pending_loads})}
+    
+    def _new_rows_filter(self) -> str:
+        """Условие отбора строк источника за даты новых загрузок, которых нет в целевой таблице"""
+        return f"""
+            date = ANY(:dates)
+            AND NOT EXISTS (
+                SELECT 1 FROM {self.target_table} p 
+                WHERE p.date = {self.source_table}.date 
+                  AND p.query = {self.source_table}.query 
+                  AND p.page_path = {self.source_table}.page_path
+                  AND p.device = {self.source_table}.device
+            )
+        """
+    
+    def _record_load(self, db, df: pd.DataFrame):
+        """Запись журнала ppl.webmaster_aggregated_loads в транзакции загрузки строк"""
+        db.execute(text(f"""
+            INSERT INTO {self.target_loads_table} (id_from, id_to, row_count, date_from, date_to)
+            VALUES (:id_from, :id_to, :row_count, :date_from, :date_to)
+        """), {
+            'id_from': int(df['id'].min()),
+            'id_to': int(df['id'].max()),
+            'row_count': len(df),
+            'date_from': df['date'].min(),
+            'date_to': df['date'].max()
+        })
+    
+    def _extract_query(self):
+        return text(f"""
+        SELECT * FROM {self.source_table} 
+        WHERE {self._new_rows_filter()}
+        ORDER BY date, query, page_path, device
+        """)
+    
+    def run(self, mode: str = None, streaming: bool = None):
+        """Запуск в режиме pandas (по умолчанию) или sql"""
+        mode = mode or settings.app.aggregation_mode
+        if mode == 'sql':
+            return self.run_sql()
+        return super().run(streaming=streaming)
+    
+    def run_sql(self) -> int:
+        """Та же обработка одним INSERT ... SELECT на стороне Postgres"""
+        try:
+            self.logger.info(f"🚀 Запуск {self.__class__.__name__} (sql)")
+            if not self.begin_run():
+                return 0
+            params = self._extract_params()
+            
+            with get_db() as db:
+                self._ensure_id_sequence(db)
+                
+                # GREATEST/LEAST повторяют клампы из transform; nextval вычисляется
+                # после ORDER BY, поэтому id идут в том же порядке, что и в pandas-режиме.
+                # Запись журнала и last_date берутся из вставленных строк тем же запросом
+                insert_query = text(f"""
+                WITH inserted AS (
+                    INSERT INTO {self.target_table} 
+                    (id, date, query, page_path, device, demand, impressions, clicks, position)
+                    SELECT 
+                        nextval('{self.id_sequence}'),
+                        date, query, page_path, device,
+                        GREATEST(COALESCE(demand, 0), COALESCE(impressions, 0)),
+                        COALESCE(impressions, 0),
+                        LEAST(COALESCE(clicks, 0), COALESCE(impressions, 0)),
+                        COALESCE(position, 0)
+                    FROM {self.source_table} 
+                    WHERE {self._new_rows_filter()}
+                    ORDER BY date, query, page_path, device
+                    RETURNING id, date
+                ), load AS (
+                    INSERT INTO {self.target_loads_table} (id_from, id_to, row_count, date_from, date_to)
+                    SELECT MIN(id), MAX(id), COUNT(*), MIN(date), MAX(date) FROM inserted
+                    HAVING COUNT(*) > 0
+                    RETURNING row_count, date_to
+                )
+                SELECT COALESCE(SUM(row_count), 0), MAX(date_to) FROM load
+                """)
+                
+                loaded_count, last_date = db.execute(insert_query, params).fetchone()
+                loaded_count = int(loaded_count)
+                
+                # Загрузки rdl отмечаются в той же транзакции, что и вставка
+                self.state.mark_processed(self.stage, [load['load_id'] for load in self.pending_loads], db=db)
+            
+            self.pending_loads = []
+            self.state.advance(self.stage, last_date=last_date, rows=loaded_count)
+            self.end_run('success')
+            self.logger.success(f"✅ {self.__class__.__name__} завершен: {loaded_count} строк")
+            return loaded_count
+            
+        except Exception as e:
+            self.logger.error(f"❌ Ошибка в {self.__class__.__name__}: {e}")
+            self.end_run('failed')
+            raise
     
     def extract(self) -> pd.DataFrame:
         """Извлекаем новые данные из rdl.webmaster"""
         self.logger.info("🔍 Извлечение новых данных...")
         
         with get_db() as db:
-            # Получаем максимальную дату из целевой таблицы
-            max_date_query = text(f"""
-                SELECT COALESCE(MAX(date), '2000-01-01') as max_date 
-                FROM {self.target_table}
-            """)
-            max_date = db.execute(max_date_query).fetchone()[0]
-            self.logger.info(f"📅 Последняя дата в целевой таблице: {max_date}")
-            
-            # Загружаем данные, которых нет в целевой таблице
-            query = text(f"""
-            SELECT * FROM {self.source_table} 
-            WHERE date > :max_date 
-               OR (date = :max_date AND NOT EXISTS (
-                   SELECT 1 FROM {self.target_table} p 
-                   WHERE p.date = {self.source_table}.date 
-                     AND p.query = {self.source_table}.query 
-                     AND p.page_path = {self.source_table}.page_path
-                     AND p.device = {self.source_table}.device
-               ))
-            ORDER BY date, query, page_path, device
-            """)
-            
-            result = db.execute(query, {"max_date": max_date})
+            # Загружаем данные после водяного знака, которых нет в целевой таблице
+            result = db.execute(self._extract_query(), self._extract_params())
             columns = result.keys()
             data = result.fetchall()
             
@@ -56,6 +188,14 @@ class AggregatedETL(BaseETL):
             else:
                 return pd.DataFrame()
     
+    def extract_chunks(self):
+        """Новые строки rdl.webmaster чанками через серверный курсор"""
+        self.logger.info("🔍 Извлечение новых данных (потоково)...")
+        
+        # Курсор видит снимок на начало запроса, поэтому строки, загруженные
+        # предыдущими чанками, не попадут в следующие
+        yield from self.stream_query(self._extract_query(), self._extract_params())
+    
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         """Применяем бизнес-логику и готовим данные"""
         if df.empty:
@@ -98,12 +238,8 @@ class AggregatedETL(BaseETL):
         self.logger.info(f"💾 Сохранение {len(df)} строк...")
         
         with get_db() as db:
-            # Получаем последний ID
-            last_id_query = text(f"SELECT COALESCE(MAX(id), 0) FROM {self.target_table}")
-            last_id = db.execute(last_id_query).fetchone()[0]
-            
-            # Создаем новые ID
-            df['id'] = range(last_id + 1, last_id + len(df) + 1)
+            # Резервируем блок ID в последовательности
+            df['id'] = self._reserve_ids(db, len(df))
             
             # Вставляем данные
             for _, row in df.iterrows():
@@ -125,5 +261,6 @@ class AggregatedETL(BaseETL):
                     'position': float(row['position']) if pd.notna(row['position']) else 0.0
                 })
             
-            self.logger.info(f"📈 Новый диапазон ID: {last_id + 1} - {last_id + len(df)}")
+            self._record_load(db, df)
+            self.logger.info(f"📈 Новый диапазон ID: {df['id'].min()} - {df['id'].max()}")
             return len(df)
\ No newline at end of file
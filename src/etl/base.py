@@ -1,11 +1,22 @@
+import io
 import sys
+import time
 from pathlib import Path
 from abc import ABC, abstractmethod
+from typing import List, Iterator, Optional, Tuple
+import pandas as pd
 from loguru import logger
+from sqlalchemy import text
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from config.settings import settings
-from src.models.database import get_db
+from src.models.database import get_db, engine
+from src.etl.state import ETLState
+from src.utils.metrics import metrics
+
+# Размер блока id, которыми в журнал загрузок заносятся строки,
+# загруженные до его появления
+LEGACY_LOAD_BLOCK = 100000
 
 
 class BaseETL(ABC):
@@ -14,6 +25,20 @@ class BaseETL(ABC):
     def __init__(self):
         self.logger = logger
         self.schema = "ppl"
+        self.copy_batch_size = settings.app.copy_batch_size
+        self.chunk_size = settings.app.etl_chunk_size
+        # Шард (id_from, id_to]; None — все строки
+        self.id_range = None
+        self.seed = settings.app.generator_seed
+        # Имя этапа в ppl.etl_state; None — этап без водяного знака
+        self.stage = None
+        self.state = ETLState()
+        self.watermark = {}
+        # Журнал загрузок источника, по которому этап находит новые данные,
+        # и этап, который должен обработать загрузку раньше
+        self.loads_table = None
+        self.requires_stage = None
+        self.pending_loads: List[dict] = []
     
     @abstractmethod
     def extract(self):
@@ -30,26 +55,326 @@ class BaseETL(ABC):
         """Загрузка данных в целевую таблицу"""
         pass
     
-    def run(self):
-        """Запуск полного ETL процесса"""
+    def _bootstrap_watermark(self, db) -> dict:
+        """Начальный водяной знак по уже загруженным данным (вызывается один раз)"""
+        return {}
+    
+    def _cleanup_unfinished(self, db) -> int:
+        """Удаляет строки, записанные упавшим запуском для необработанных загрузок"""
+        return 0
+    
+    def _chunk_watermark(self, chunk) -> dict:
+        """last_date/last_id, до которых обработан извлеченный чанк"""
+        return {}
+    
+    def _completed_loads(self, chunk) -> List[dict]:
+        """Загрузки, обработанные целиком после сохранения чанка; остальные отмечаются в конце запуска"""
+        return []
+    
+    def begin_run(self) -> bool:
+        """Берет блокировку этапа, читает его состояние и необработанные загрузки.
+
+        Возвращает False, если этап уже выполняется в другом процессе: тогда
+        запуск пропускается, а чужие данные не трогаются. Шарды (id_range
+        задан) состояние не трогают — это делает координатор.
+        """
+        if self.stage is None or self.id_range is not None:
+            return True
+        
+        if not self.state.try_lock(self.stage):
+            self.logger.warning(f"⏭️ Этап {self.stage} уже выполняется в другом процессе, запуск пропущен")
+            return False
+        
+        try:
+            self.watermark = self.state.start(self.stage, self._bootstrap_watermark)
+            self.logger.info(f"🔖 Водяной знак {self.stage}: дата {self.watermark['last_date']}, ID {self.watermark['last_id']}")
+            if self.watermark['previous_status'] in ('running', 'failed'):
+                self.logger.warning(f"⚠️ Предыдущий запуск {self.stage} не завершен")
+            
+            if self.loads_table is not None:
+                self.pending_loads = self.state.pending_loads(self.stage, self.loads_table, self.requires_stage)
+                self.logger.info(f"📥 Необработанных загрузок {self.loads_table}: {len(self.pending_loads)}")
+            
+            # Под блокировкой строки необработанных загрузок в целевой таблице
+            # могут остаться только от упавшего запуска
+            if self.pending_loads:
+                with get_db() as db:
+                    deleted = self._cleanup_unfinished(db)
+                if deleted:
+                    self.logger.warning(f"🧹 Удалено {deleted} строк незавершенного запуска {self.stage}")
+        except Exception:
+            self.state.unlock(self.stage)
+            raise
+        return True
+    
+    def advance_watermark(self, chunk, rows: int):
+        if self.stage is None or self.id_range is not None:
+            return
+        mark = self._chunk_watermark(chunk)
+        self.state.advance(self.stage, mark.get('last_date'), mark.get('last_id'), rows)
+        
+        completed = {load['load_id'] for load in self._completed_loads(chunk)}
+        if completed:
+            self.state.mark_processed(self.stage, list(completed))
+            self.pending_loads = [load for load in self.pending_loads if load['load_id'] not in completed]
+    
+    def end_run(self, status: str):
+        if self.stage is None or self.id_range is not None:
+            return
+        try:
+            # После успешного запуска обработаны все загрузки, прочитанные в begin_run
+            if status == 'success' and self.pending_loads:
+                self.state.mark_processed(self.stage, [load['load_id'] for load in self.pending_loads])
+                self.pending_loads = []
+            self.state.finish(self.stage, status)
+        finally:
+            self.state.unlock(self.stage)
+    
+    def _timed(self, phase: str, func, data=None):
+        """Выполняет фазу ETL под таймером etl_phase: время, строки и байты"""
+        with metrics.timer('etl_phase', stage=self.stage or self.__class__.__name__, phase=phase) as timing:
+            result = func() if data is None else func(data)
+            if data is not None and isinstance(result, int):
+                # load возвращает число строк; байты считаем по входному DataFrame
+                timing.record(data)
+                timing.rows = result
+            else:
+                timing.record(result)
+        return result
+    
+    def _timed_chunks(self) -> Iterator[pd.DataFrame]:
+        """extract_chunks(), где ожидание каждого чанка замеряется как фаза extract"""
+        chunks = iter(self.extract_chunks())
+        while True:
+            with metrics.timer('etl_phase', stage=self.stage or self.__class__.__name__, phase='extract') as timing:
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    timing.record(chunk)
+            if chunk is None:
+                return
+            yield chunk
+    
+    def extract_chunks(self) -> Iterator:
+        """Извлечение данных чанками для потокового режима.
+
+        По умолчанию весь результат extract() отдается одним чанком;
+        подклассы переопределяют метод через stream_query().
+        """
+        data = self.extract()
+        if not data.empty:
+            yield data
+    
+    def stream_query(self, query, params: dict = None) -> Iterator[pd.DataFrame]:
+        """Читает результат запроса серверным курсором чанками по ETL_CHUNK_SIZE строк"""
+        with get_db() as db:
+            result = db.execute(
+                query.execution_options(stream_results=True, yield_per=self.chunk_size),
+                params or {}
+            )
+            columns = list(result.keys())
+            for rows in result.partitions():
+                yield pd.DataFrame(rows, columns=columns)
+    
+    def copy_frame(self, table: str, df: pd.DataFrame, columns: List[str]) -> int:
+        """Массовая загрузка столбцов DataFrame через COPY FROM STDIN.
+
+        Данные уходят пакетами по COPY_BATCH_SIZE строк через CSV-буфер
+        в памяти; каждый пакет коммитится отдельно.
+        """
+        total = len(df)
+        if total == 0:
+            return 0
+        
+        copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        started = time.perf_counter()
+        
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                for start in range(0, total, self.copy_batch_size):
+                    buffer = io.StringIO()
+                    df.iloc[start:start + self.copy_batch_size].to_csv(
+                        buffer, columns=columns, index=False, header=False
+                    )
+                    metrics.inc('etl_copy_bytes_total', buffer.tell(), table=table)
+                    buffer.seek(0)
+                    cursor.copy_expert(copy_sql, buffer)
+                    connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed > 0 else float(total)
+        self.logger.info(f"⚡ COPY {table}: {total} строк за {elapsed:.1f} с ({rate:,.0f} строк/с)")
+        return total
+    
+    def run(self, streaming: bool = None):
+        """Запуск полного ETL процесса
+
+        streaming: обрабатывать данные чанками; по умолчанию ETL_STREAMING из настроек
+        """
+        if streaming is None:
+            streaming = settings.app.etl_streaming
+        if streaming:
+            return self.run_streaming()
+        
         try:
             self.logger.info(f"🚀 Запуск {self.__class__.__name__}")
+            if not self.begin_run():
+                return 0
             
             # Extract
-            extracted_data = self.extract()
+            extracted_data = self._timed('extract', self.extract)
             if extracted_data.empty:
                 self.logger.info("ℹ️ Нет новых данных для обработки")
+                self.end_run('success')
                 return 0
             
             # Transform
-            transformed_data = self.transform(extracted_data)
+            transformed_data = self._timed('transform', self.transform, extracted_data)
             
             # Load
-            loaded_count = self.load(transformed_data)
+            loaded_count = self._timed('load', self.load, transformed_data)
+            self.advance_watermark(extracted_data, loaded_count)
+            self.end_run('success')
+            
+            self.logger.success(f"✅ {self.__class__.__name__} завершен: {loaded_count} строк")
+            return loaded_count
+            
+        except Exception as e:
+            self.logger.error(f"❌ Ошибка в {self.__class__.__name__}: {e}")
+            self.end_run('failed')
+            raise
+    
+    def run_streaming(self):
+        """Потоковый запуск: каждый чанк проходит transform и load сразу после извлечения,
+        поэтому память ограничена размером чанка, а не объемом необработанных данных"""
+        try:
+            self.logger.info(f"🚀 Запуск {self.__class__.__name__} (чанками по {self.chunk_size} строк)")
+            if not self.begin_run():
+                return 0
+            
+            loaded_count = 0
+            chunks = 0
+            for chunk in self._timed_chunks():
+                if chunk.empty:
+                    continue
+                chunks += 1
+                chunk_loaded = self._timed('load', self.load, self._timed('transform', self.transform, chunk))
+                # Водяной знак двигается после каждого зафиксированного чанка
+                self.advance_watermark(chunk, chunk_loaded)
+                loaded_count += chunk_loaded
+                self.logger.info(f"📦 Чанк {chunks}: {len(chunk)} строк, всего загружено {loaded_count}")
+            
+            self.end_run('success')
+            
+            if chunks == 0:
+                self.logger.info("ℹ️ Нет новых данных для обработки")
+                return 0
             
             self.logger.success(f"✅ {self.__class__.__name__} завершен: {loaded_count} строк")
             return loaded_count
             
         except Exception as e:
             self.logger.error(f"❌ Ошибка в {self.__class__.__name__}: {e}")
-            raise
\ No newline at end of file
+            self.end_run('failed')
+            raise
+
+
+class GeneratorETL(BaseETL):
+    """Этап генерации по строкам ppl.webmaster_aggregated (позиции, клики).
+
+    Новые строки — диапазоны id необработанных записей журнала
+    ppl.webmaster_aggregated_loads. Такие этапы можно делить на шарды по
+    диапазонам ID: координатор берет pending_id_range() и запускает копии
+    этапа с id_range и теми же загрузками.
+    """
+    
+    def __init__(self, id_range: Optional[Tuple[int, int]] = None, pending_loads: List[dict] = None):
+        super().__init__()
+        self.id_range = id_range
+        self.source_table = f"{self.schema}.webmaster_aggregated"
+        self.loads_table = f"{self.schema}.webmaster_aggregated_loads"
+        self.pending_loads = pending_loads or []
+    
+    @abstractmethod
+    def _pending_filter(self) -> str:
+        """Условие на строки source_table (алиас wa), которым нужна генерация"""
+        pass
+    
+    def _pending_rows(self) -> str:
+        """FROM/WHERE строк необработанных загрузок (алиас wa), при шарде — только его часть"""
+        clause = f"""
+        FROM {self.loads_table} l
+        JOIN {self.source_table} wa ON wa.id BETWEEN l.id_from AND l.id_to
+        WHERE l.load_id = ANY(:load_ids) AND {self._pending_filter()}
+        """
+        if self.id_range is not None:
+            clause += " AND wa.id > :id_from AND wa.id <= :id_to"
+        return clause
+    
+    def _extract_params(self) -> dict:
+        params = {'load_ids': [int(load['load_id']) for load in self.pending_loads]}
+        if self.id_range is not None:
+            params.update(id_from=self.id_range[0], id_to=self.id_range[1])
+        return params
+    
+    def _register_legacy_loads(self, db):
+        """Заносит в журнал строки, загруженные до его появления, блоками по LEGACY_LOAD_BLOCK id.
+
+        Блоки не пересекаются и лежат ниже первой записи журнала, поэтому
+        повторный вызов ничего не добавляет. Advisory lock не дает позициям
+        и кликам зарегистрировать одни и те же строки одновременно.
+        """
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": self.loads_table})
+        registered = db.execute(text(f"""
+            INSERT INTO {self.loads_table} (id_from, id_to, row_count, date_from, date_to)
+            SELECT MIN(id), MAX(id), COUNT(*), MIN(date), MAX(date)
+            FROM {self.source_table}
+            WHERE id < COALESCE((SELECT MIN(id_from) FROM {self.loads_table}), 9223372036854775807)
+            GROUP BY id / :block
+            ORDER BY MIN(id)
+        """), {"block": LEGACY_LOAD_BLOCK}).rowcount
+        if registered:
+            self.logger.info(f"📒 В журнал {self.loads_table} занесено {registered} блоков ранее загруженных строк")
+    
+    def _bootstrap_watermark(self, db) -> dict:
+        """Первый запуск: загрузки до MAX(id) целевой таблицы уже обработаны.
+
+        Блок, на котором остановился прошлый запуск, остается необработанным:
+        begin_run удалит его частичные строки и этап сгенерирует его заново.
+        """
+        self._register_legacy_loads(db)
+        last_id = int(db.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {self.target_table}")).scalar())
+        processed = db.execute(
+            text(f"SELECT load_id FROM {self.loads_table} WHERE id_to <= :last_id"), {"last_id": last_id}
+        ).scalars().all()
+        self.state.mark_processed(self.stage, processed, db=db)
+        return {'last_id': last_id}
+    
+    def _cleanup_unfinished(self, db) -> int:
+        return db.execute(text(f"""
+            DELETE FROM {self.target_table} t
+            USING {self.loads_table} l
+            WHERE l.load_id = ANY(:load_ids) AND t.id BETWEEN l.id_from AND l.id_to
+        """), {'load_ids': [int(load['load_id']) for load in self.pending_loads]}).rowcount
+    
+    def _chunk_watermark(self, chunk) -> dict:
+        return {'last_id': int(chunk['id'].max())}
+    
+    def _completed_loads(self, chunk) -> List[dict]:
+        # Чанки идут по возрастанию id, а диапазоны загрузок не пересекаются
+        last_id = int(chunk['id'].max())
+        return [load for load in self.pending_loads if load['id_to'] <= last_id]
+    
+    def pending_id_range(self) -> Optional[Tuple[int, int]]:
+        """Минимальный и максимальный ID строк, ожидающих обработки"""
+        with get_db() as db:
+            query = text(f"SELECT MIN(wa.id), MAX(wa.id) {self._pending_rows()}")
+            min_id, max_id = db.execute(query, self._extract_params()).fetchone()
+        if min_id is None:
+            return None
+        return int(min_id), int(max_id)
@@ -1,157 +1,227 @@
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import sys
 from pathlib import Path
 from sqlalchemy import text  # Добавляем импорт
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from src.etl.base import BaseETL
+from config.settings import settings
+from src.etl.base import GeneratorETL
+from src.etl.seeding import row_seeds, uniforms
 from src.models.database import get_db
 
 
-class ClicksGeneratorETL(BaseETL):
+# Вес клика по позиции показа: индекс массива — позиция (1-10)
+POSITION_WEIGHTS = np.array([0.0, 0.30, 0.15, 0.08, 0.05, 0.03, 0.02, 0.015, 0.012, 0.01, 0.008])
+DEFAULT_POSITION_WEIGHT = 0.005
+
+
+class ClicksGeneratorETL(GeneratorETL):
     """Генерация кликов для ppl.webmaster_clicks"""
     
-    def __init__(self):
-        super().__init__()
-        self.source_table = f"{self.schema}.webmaster_aggregated"
+    def __init__(self, id_range: Optional[Tuple[int, int]] = None, pending_loads: List[dict] = None):
+        super().__init__(id_range, pending_loads)
         self.positions_table = f"{self.schema}.webmaster_positions"
         self.target_table = f"{self.schema}.webmaster_clicks"
+        self.stage = 'clicks'
+        # Клики распределяются по позициям, поэтому загрузка ждет этапа позиций
+        self.requires_stage = 'positions'
+        self.batch_size = settings.app.batch_size
+    
+    def _pending_filter(self) -> str:
+        """Клики нужны строкам с кликами"""
+        return "wa.clicks > 0"
+    
+    def _extract_query(self):
+        return text(f"""
+        SELECT 
+            wa.id, wa.date, wa.query, wa.page_path, wa.device, wa.clicks
+        {self._pending_rows()}
+        ORDER BY wa.id
+        """)
+    
+    @staticmethod
+    def _prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+        df['id'] = df['id'].astype(int)
+        df['clicks'] = df['clicks'].astype(int)
+        return df
     
     def extract(self) -> pd.DataFrame:
         """Извлекаем строки с кликами без сгенерированных кликов"""
         self.logger.info("🔍 Поиск данных для генерации кликов...")
         
         with get_db() as db:
-            query = text(f"""
-            SELECT 
-                wa.id, wa.clicks
-            FROM {self.source_table} wa
-            WHERE wa.clicks > 0 
-              AND NOT EXISTS (
-                  SELECT 1 FROM {self.target_table} wc 
-                  WHERE wc.id = wa.id
-              )
-            ORDER BY wa.id
-            """)
-            
-            result = db.execute(query)
+            result = db.execute(self._extract_query(), self._extract_params())
             columns = result.keys()
             data = result.fetchall()
             
             if data:
-                df = pd.DataFrame(data, columns=columns)
-                df['id'] = df['id'].astype(int)
-                df['clicks'] = df['clicks'].astype(int)
+                df = self._prepare_frame(pd.DataFrame(data, columns=columns))
                 
                 self.logger.info(f"📈 Найдено {len(df)} строк для генерации кликов")
                 return df
             else:
                 return pd.DataFrame()
     
-    def _get_positions_for_id(self, row_id: int) -> List[Tuple[int, int]]:
-        """Получаем позиции для конкретного ID"""
-        with get_db() as db:
-            query = text(f"""
-            SELECT impression_position, impression_order 
-            FROM {self.positions_table}
-            WHERE id = :row_id
-            ORDER BY impression_order
-            """)
-            
-            result = db.execute(query, {'row_id': row_id})
-            return [(int(row[0]), int(row[1])) for row in result.fetchall()]
+    def extract_chunks(self):
+        """Строки с кликами чанками через серверный курсор"""
+        self.logger.info("🔍 Поиск данных для генерации кликов (потоково)...")
+        for df in self.stream_query(self._extract_query(), self._extract_params()):
+            yield self._prepare_frame(df)
+    
+    def _get_positions_for_ids(self, db, row_ids: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Получаем позиции для пачки ID одним запросом.
+
+        Возвращает плоские массивы (id, позиция, порядок показа),
+        отсортированные по id и impression_order.
+        """
+        query = text(f"""
+        SELECT id, impression_position, impression_order 
+        FROM {self.positions_table}
+        WHERE id = ANY(:row_ids)
+        ORDER BY id, impression_order
+        """)
+        
+        rows = db.execute(query, {'row_ids': row_ids}).fetchall()
+        if not rows:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        
+        data = np.array(rows, dtype=np.int64)
+        return data[:, 0], data[:, 1], data[:, 2]
     
-    def _distribute_clicks(self, row_id: int, clicks: int, positions_with_order: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
-        """Распределение кликов по показам"""
+    def _distribute_clicks(self, row_id: int, clicks: int, positions_with_order: List[Tuple[int, int]],
+                           seed: int = 0) -> List[Dict[str, Any]]:
+        """Распределение кликов по показам одной строки"""
         if clicks == 0 or len(positions_with_order) == 0:
             return []
         
-        position_weights = {
-            1: 0.30, 2: 0.15, 3: 0.08, 4: 0.05, 5: 0.03,
-            6: 0.02, 7: 0.015, 8: 0.012, 9: 0.01, 10: 0.008
-        }
-        
-        weights = []
-        for pos, order in positions_with_order:
-            weight = position_weights.get(pos, 0.005)
-            time_weight = 1.0 / (order * 0.1 + 1)
-            weights.append(weight * time_weight)
-        
-        total_weight = sum(weights)
-        if total_weight == 0:
-            weights = [1.0 / len(positions_with_order)] * len(positions_with_order)
-        else:
-            weights = [w / total_weight for w in weights]
-        
-        if clicks <= len(positions_with_order):
-            chosen_indices = np.random.choice(
-                len(positions_with_order), 
-                size=clicks, 
-                replace=False, 
-                p=weights
-            )
-        else:
-            chosen_indices = np.random.choice(
-                len(positions_with_order), 
-                size=clicks, 
-                replace=True, 
-                p=weights
-            )
-        
-        result = []
-        for idx in chosen_indices:
-            pos, order = positions_with_order[idx]
-            result.append({
-                'id': row_id,
-                'click_position': int(pos),
-                'impression_order': int(order)
-            })
-        
-        return result
+        positions_array = np.array(positions_with_order, dtype=np.int64)
+        ids, click_positions, orders = self._distribute_clicks_batch(
+            np.array([row_id], dtype=np.int64),
+            np.array([clicks], dtype=np.int64),
+            np.array([0, len(positions_with_order)], dtype=np.int64),
+            positions_array[:, 0],
+            positions_array[:, 1],
+            np.array([seed], dtype=np.uint64)
+        )
+        
+        return [
+            {'id': int(i), 'click_position': int(pos), 'impression_order': int(order)}
+            for i, pos, order in zip(ids, click_positions, orders)
+        ]
+    
+    def _distribute_clicks_batch(self, row_ids: np.ndarray, clicks: np.ndarray, offsets: np.ndarray,
+                                 positions: np.ndarray, orders: np.ndarray,
+                                 seeds: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Распределение кликов по показам сразу для многих строк.
+
+        Показы строки i лежат в positions[offsets[i]:offsets[i + 1]] (и так же в orders).
+        Вес показа — вес позиции (CTR по позиции, 0.005 за пределами топ-10),
+        умноженный на 1 / (order * 0.1 + 1). Если кликов не больше показов,
+        показы выбираются без повторов (ключи Efraimidis–Spirakis log(u) / w
+        дают то же распределение, что и последовательный np.random.choice
+        с replace=False), иначе — с повторами по накопленным весам строки.
+        Случайные числа строки i берутся из потока seeds[i].
+
+        Возвращает столбцы (id, click_position, impression_order).
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        clicks = np.asarray(clicks, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        orders = np.asarray(orders, dtype=np.int64)
+        
+        counts = np.diff(offsets)
+        clicks = np.where(counts > 0, clicks, 0)
+        segment = np.repeat(np.arange(len(row_ids)), counts)
+        
+        in_top = (positions >= 1) & (positions < len(POSITION_WEIGHTS))
+        weights = np.where(in_top, POSITION_WEIGHTS[np.where(in_top, positions, 0)], DEFAULT_POSITION_WEIGHT)
+        weights = weights / (orders * 0.1 + 1)
+        
+        totals = np.bincount(segment, weights=weights, minlength=len(row_ids))
+        weights = np.where(totals[segment] > 0, weights, 1.0)
+        
+        chosen = []
+        
+        # Без повторов: в каждой строке берем clicks показов с наибольшим ключом
+        without_replacement = (clicks > 0) & (clicks <= counts)
+        mask = without_replacement[segment]
+        if mask.any():
+            element_index = np.flatnonzero(mask)
+            element_segment = segment[mask]
+            local_index = (element_index - offsets[element_segment]).astype(np.uint64)
+            keys = np.log(uniforms(seeds[element_segment], local_index)) / weights[mask]
+            order = np.lexsort((-keys, element_segment))
+            sorted_segment = element_segment[order]
+            first_in_segment = np.searchsorted(sorted_segment, sorted_segment, side='left')
+            rank = np.arange(len(order)) - first_in_segment
+            take = rank < clicks[sorted_segment]
+            chosen.append((sorted_segment[take], element_index[order][take]))
+        
+        # С повторами: clicks независимых выборок по весам строки. После клампа
+        # clicks <= impressions в агрегации такие строки единичны, поэтому cumsum
+        # считается по каждой строке отдельно и не зависит от соседей по пакету
+        for row in np.flatnonzero(clicks > counts):
+            start, end = offsets[row], offsets[row + 1]
+            cumulative = np.cumsum(weights[start:end])
+            targets = uniforms(np.full(clicks[row], seeds[row]), np.arange(clicks[row])) * cumulative[-1]
+            index = start + np.minimum(np.searchsorted(cumulative, targets, side='right'), end - start - 1)
+            chosen.append((np.full(clicks[row], row), index))
+        
+        if not chosen:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        
+        chosen_segment = np.concatenate([seg for seg, _ in chosen])
+        chosen_index = np.concatenate([idx for _, idx in chosen])
+        
+        # Клики идут в порядке строк входа
+        by_row = np.argsort(chosen_segment, kind='stable')
+        chosen_segment = chosen_segment[by_row]
+        chosen_index = chosen_index[by_row]
+        
+        return row_ids[chosen_segment], positions[chosen_index], orders[chosen_index]
     
-    def transform(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         """Генерируем клики для всех строк"""
         if df.empty:
-            return []
+            return pd.DataFrame()
         
         self.logger.info("🎲 Распределение кликов...")
         
-        all_clicks = []
-        for _, row in df.iterrows():
-            row_id = int(row['id'])
-            clicks = int(row['clicks'])
-            
-            # Получаем позиции для этого ID
-            positions = self._get_positions_for_id(row_id)
-            
-            if positions:
-                click_assignments = self._distribute_clicks(row_id, clicks, positions)
-                all_clicks.extend(click_assignments)
+        df = df.sort_values('id')
+        columns = []
+        with get_db() as db:
+            for start in range(0, len(df), self.batch_size):
+                batch = df.iloc[start:start + self.batch_size]
+                row_ids = batch['id'].to_numpy(dtype=np.int64)
+                
+                # Позиции для всей пачки ID одним запросом
+                position_ids, positions, orders = self._get_positions_for_ids(db, row_ids.tolist())
+                offsets = np.append(np.searchsorted(position_ids, row_ids, side='left'), len(position_ids))
+                
+                columns.append(self._distribute_clicks_batch(
+                    row_ids, batch['clicks'].to_numpy(dtype=np.int64), offsets, positions, orders,
+                    row_seeds(self.seed, 'clicks', batch)
+                ))
+        
+        all_clicks = pd.DataFrame({
+            'id': np.concatenate([c[0] for c in columns]),
+            'click_position': np.concatenate([c[1] for c in columns]),
+            'impression_order': np.concatenate([c[2] for c in columns])
+        })
         
         self.logger.info(f"🎯 Сгенерировано {len(all_clicks)} кликов")
         return all_clicks
     
-    def load(self, data: List[Dict[str, Any]]) -> int:
+    def load(self, data: pd.DataFrame) -> int:
         """Сохраняем клики в БД"""
-        if not data:
+        if data.empty:
             return 0
         
         self.logger.info(f"💾 Сохранение {len(data)} кликов...")
         
-        with get_db() as db:
-            for item in data:
-                insert_query = text(f"""
-                INSERT INTO {self.target_table} 
-                (id, click_position, impression_order)
-                VALUES (:id, :click_position, :impression_order)
-                """)
-                
-                db.execute(insert_query, {
-                    'id': int(item['id']),
-                    'click_position': int(item['click_position']),
-                    'impression_order': int(item['impression_order'])
-                })
-        
-        return len(data)
\ No newline at end of file
+        return self.copy_frame(self.target_table, data, ['id', 'click_position', 'impression_order'])
\ No newline at end of file
@@ -1,26 +1,70 @@
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
 from pathlib import Path
+from typing import List, Tuple
 from loguru import logger
 from sqlalchemy import text  # Добавляем импорт
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from config.settings import settings
 from src.etl.aggregator import AggregatedETL
 from src.etl.positions_generator import PositionsGeneratorETL
 from src.etl.clicks_generator import ClicksGeneratorETL
-from src.models.database import get_db  # Добавляем импорт
+from src.models.database import get_db, engine  # Добавляем импорт
+from src.utils.metrics import metrics
+from src.utils.profiling import profiled
+
+
+# Этапы, которые можно запускать шардами по диапазонам ID
+SHARDED_STAGES = {
+    'positions': PositionsGeneratorETL,
+    'clicks': ClicksGeneratorETL,
+}
+
+
+def _init_shard_worker():
+    """Дочерний процесс не должен использовать соединения пула родителя"""
+    engine.dispose(close=False)
+
+
+def _run_shard(stage: str, id_range: Tuple[int, int], pending_loads: List[dict],
+               streaming: bool = None) -> int:
+    """Запуск этапа на одном шарде в отдельном процессе со своим соединением к БД"""
+    etl = SHARDED_STAGES[stage](id_range=id_range, pending_loads=pending_loads)
+    return etl.run(streaming=streaming)
+
+
+def split_id_range(min_id: int, max_id: int, shards: int) -> List[Tuple[int, int]]:
+    """Делит [min_id, max_id] на непересекающиеся полуинтервалы (id_from, id_to]"""
+    shards = max(1, min(shards, max_id - min_id + 1))
+    step = (max_id - min_id + 1) / shards
+    bounds = [min_id - 1 + round(step * i) for i in range(shards + 1)]
+    bounds[-1] = max_id
+    return [(bounds[i], bounds[i + 1]) for i in range(shards) if bounds[i] < bounds[i + 1]]
 
 
 class ETLCoordinator:
     """Координатор всех ETL процессов"""
     
-    def __init__(self):
+    def __init__(self, profile_mode: str = None, profile_stage: str = None):
         self.logger = logger
+        # Профилирование одного этапа: режим из PROFILE_MODES и имя этапа
+        self.profile_mode = profile_mode
+        self.profile_stage = profile_stage
         self.aggregator = AggregatedETL()
         self.positions_generator = PositionsGeneratorETL()
         self.clicks_generator = ClicksGeneratorETL()
     
-    def run_full_pipeline(self) -> dict:
-        """Запуск полного ETL пайплайна"""
+    def run_full_pipeline(self, aggregation_mode: str = None, streaming: bool = None,
+                          shards: int = None) -> dict:
+        """Запуск полного ETL пайплайна
+
+        aggregation_mode: 'pandas' или 'sql'; по умолчанию AGGREGATION_MODE из настроек
+        streaming: потоковая обработка чанками; по умолчанию ETL_STREAMING из настроек
+        shards: число процессов для генерации позиций и кликов; по умолчанию ETL_SHARDS
+        """
+        shards = shards or settings.app.etl_shards
         self.logger.info("=" * 60)
         self.logger.info("🚀 ЗАПУСК ПОЛНОГО ETL ПАЙПЛАЙНА")
         self.logger.info("=" * 60)
@@ -30,15 +74,16 @@ class ETLCoordinator:
         try:
             # Шаг 1: Загрузка агрегированных данных
             self.logger.info("\n📊 ШАГ 1: Загрузка в webmaster_aggregated")
-            results['aggregated'] = self.aggregator.run()
+            with metrics.timer('etl_stage', stage='aggregated') as timing, self._profiled('aggregated'):
+                results['aggregated'] = timing.rows = self.aggregator.run(mode=aggregation_mode, streaming=streaming)
             
             # Шаг 2: Генерация позиций
             self.logger.info("\n🎯 ШАГ 2: Генерация позиций")
-            results['positions'] = self.positions_generator.run()
+            results['positions'] = self._run_stage('positions', self.positions_generator, streaming, shards)
             
             # Шаг 3: Генерация кликов
             self.logger.info("\n🖱️ ШАГ 3: Генерация кликов")
-            results['clicks'] = self.clicks_generator.run()
+            results['clicks'] = self._run_stage('clicks', self.clicks_generator, streaming, shards)
             
             # Финальная статистика
             self._print_statistics(results)
@@ -49,6 +94,49 @@ class ETLCoordinator:
             self.logger.error(f"❌ Ошибка в пайплайне: {e}")
             raise
     
+    def _run_stage(self, stage: str, etl, streaming: bool, shards: int) -> int:
+        """Запуск этапа под таймером etl_stage"""
+        if stage == self.profile_stage and shards > 1:
+            self.logger.warning(f"⚠️ Профилируется только процесс координатора, шарды {stage} не видны; "
+                                f"для профиля этапа запустите его с ETL_SHARDS=1")
+        with metrics.timer('etl_stage', stage=stage) as timing, self._profiled(stage):
+            timing.rows = self._run_stage_sharded(stage, etl, streaming, shards)
+        return timing.rows
+    
+    def _profiled(self, stage: str):
+        mode = self.profile_mode if stage == self.profile_stage else None
+        return profiled(f"etl_{stage}", mode)
+    
+    def _run_stage_sharded(self, stage: str, etl, streaming: bool, shards: int) -> int:
+        """Запуск этапа в текущем процессе или шардами в пуле процессов"""
+        if shards <= 1:
+            return etl.run(streaming=streaming)
+        
+        # Водяной знак, журнал загрузок и блокировку этапа ведет координатор, шарды их не трогают
+        if not etl.begin_run():
+            return 0
+        try:
+            id_range = etl.pending_id_range()
+            if id_range is None:
+                self.logger.info("ℹ️ Нет новых данных для обработки")
+                etl.end_run('success')
+                return 0
+            
+            ranges = split_id_range(id_range[0], id_range[1], shards)
+            self.logger.info(f"🧩 {stage}: ID {id_range[0]}-{id_range[1]}, {len(ranges)} шардов")
+            
+            with ProcessPoolExecutor(max_workers=len(ranges), initializer=_init_shard_worker) as executor:
+                futures = [executor.submit(_run_shard, stage, shard, etl.pending_loads, streaming) for shard in ranges]
+                loaded_count = sum(future.result() for future in futures)
+            
+            # Шарды завершаются в разном порядке, поэтому знак сдвигается только после всех
+            etl.state.advance(stage, last_id=id_range[1], rows=loaded_count)
+            etl.end_run('success')
+            return loaded_count
+        except Exception:
+            etl.end_run('failed')
+            raise
+    
     def _print_statistics(self, results: dict):
         """Печать статистики выполнения"""
         self.logger.info("\n" + "=" * 60)
@@ -61,31 +149,44 @@ class ETLCoordinator:
         for process, count in results.items():
             self.logger.info(f"  • {process}: {count} строк")
     
-    def check_data_consistency(self):
-        """Проверка согласованности данных"""
+    def check_data_consistency(self, days: int = None):
+        """Проверка согласованности данных за последние days дней (по умолчанию DAYS_BACK)"""
         self.logger.info("\n🔍 ПРОВЕРКА СОГЛАСОВАННОСТИ ДАННЫХ")
         
+        days = days or settings.app.days_back
+        since = date.today() - timedelta(days=days)
+        states = self.positions_generator.state.all()
+        
+        # Окно по дате отсекает старые секции webmaster_aggregated, а позиции
+        # и клики ищутся по индексам (id, impression_order) и id
         checks = [
             ("Строки без позиций", text("""
                 SELECT COUNT(*) as missing_positions
                 FROM ppl.webmaster_aggregated wa
-                WHERE wa.impressions > 0 
+                WHERE wa.date >= :since
+                  AND wa.impressions > 0 
                   AND NOT EXISTS (
-                      SELECT 1 FROM ppl.webmaster_positions wp 
-                      WHERE wp.id = wa.id
+                      SELECT 1 FROM ppl.webmaster_positions wp WHERE wp.id = wa.id
                   )
             """)),
             ("Клики без позиций", text("""
                 SELECT COUNT(*) as orphaned_clicks
-                FROM ppl.webmaster_clicks wc
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM ppl.webmaster_positions wp 
-                    WHERE wp.id = wc.id AND wp.impression_order = wc.impression_order
-                )
+                FROM ppl.webmaster_aggregated wa
+                JOIN ppl.webmaster_clicks wc ON wc.id = wa.id
+                WHERE wa.date >= :since
+                  AND NOT EXISTS (
+                      SELECT 1 FROM ppl.webmaster_positions wp 
+                      WHERE wp.id = wc.id AND wp.impression_order = wc.impression_order
+                  )
             """))
         ]
         
+        self.logger.info(f"  • Окно проверки: с {since} ({days} дн.)")
         with get_db() as db:
             for check_name, query in checks:
-                result = db.execute(query).fetchone()
-                self.logger.info(f"  • {check_name}: {result[0]}")
\ No newline at end of file
+                result = db.execute(query, {"since": since}).fetchone()
+                self.logger.info(f"  • {check_name}: {result[0]}")
+        
+        for stage, state in states.items():
+            self.logger.info(f"  • {stage}: {state['status']}, дата {state['last_date']}, "
+                             f"ID {state['last_id']}, строк {state['rows_processed']}")
\ No newline at end of file
@@ -1,140 +1,178 @@
 import pandas as pd
 import numpy as np
-import math
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import sys
 from pathlib import Path
 from sqlalchemy import text  # Добавляем импорт
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from src.etl.base import BaseETL
+from src.etl.base import GeneratorETL
+from src.etl.seeding import row_seeds, uniforms
 from src.models.database import get_db
 
 
-class PositionsGeneratorETL(BaseETL):
+# max_pos - min_pos = ceil(x + 3) - floor(x) <= 4 при x = avg_position - 1.5
+MAX_TRIALS = 4
+
+
+class PositionsGeneratorETL(GeneratorETL):
     """Генерация позиций для ppl.webmaster_positions"""
     
-    def __init__(self):
-        super().__init__()
-        self.source_table = f"{self.schema}.webmaster_aggregated"
+    def __init__(self, id_range: Optional[Tuple[int, int]] = None, pending_loads: List[dict] = None):
+        super().__init__(id_range, pending_loads)
         self.target_table = f"{self.schema}.webmaster_positions"
+        self.stage = 'positions'
+    
+    def _pending_filter(self) -> str:
+        """Позиции нужны строкам с показами"""
+        return "wa.impressions > 0"
+    
+    def _extract_query(self):
+        return text(f"""
+        SELECT 
+            wa.id, wa.date, wa.query, wa.page_path, wa.device,
+            wa.impressions, wa.clicks, wa.position
+        {self._pending_rows()}
+        ORDER BY wa.id
+        """)
+    
+    @staticmethod
+    def _prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+        # Преобразуем типы
+        df['id'] = df['id'].astype(int)
+        df['impressions'] = df['impressions'].astype(int)
+        df['clicks'] = df['clicks'].astype(int)
+        df['position'] = df['position'].astype(float)
+        return df
     
     def extract(self) -> pd.DataFrame:
         """Извлекаем строки без сгенерированных позиций"""
         self.logger.info("🔍 Поиск данных для генерации позиций...")
         
         with get_db() as db:
-            query = text(f"""
-            SELECT 
-                wa.id, wa.impressions, wa.clicks, wa.position
-            FROM {self.source_table} wa
-            WHERE wa.impressions > 0 
-              AND NOT EXISTS (
-                  SELECT 1 FROM {self.target_table} wp 
-                  WHERE wp.id = wa.id
-              )
-            ORDER BY wa.id
-            """)
-            
-            result = db.execute(query)
+            result = db.execute(self._extract_query(), self._extract_params())
             columns = result.keys()
             data = result.fetchall()
             
             if data:
-                df = pd.DataFrame(data, columns=columns)
-                # Преобразуем типы
-                df['id'] = df['id'].astype(int)
-                df['impressions'] = df['impressions'].astype(int)
-                df['clicks'] = df['clicks'].astype(int)
-                df['position'] = df['position'].astype(float)
+                df = self._prepare_frame(pd.DataFrame(data, columns=columns))
                 
                 self.logger.info(f"📈 Найдено {len(df)} строк для генерации позиций")
                 return df
             else:
                 return pd.DataFrame()
     
-    def _generate_positions_array(self, impressions: int, avg_position: float) -> List[int]:
+    def extract_chunks(self):
+        """Строки без позиций чанками через серверный курсор"""
+        self.logger.info("🔍 Поиск данных для генерации позиций (потоково)...")
+        for df in self.stream_query(self._extract_query(), self._extract_params()):
+            yield self._prepare_frame(df)
+    
+    def _generate_positions_array(self, impressions: int, avg_position: float, seed: int = 0) -> List[int]:
         """Генерация массива позиций"""
         if impressions == 0:
             return []
         
-        round_position = int(round(avg_position - 0.01))
-        sum_of_positions = int(math.ceil(avg_position * impressions))
+        positions = self._generate_positions_batch(
+            np.array([impressions], dtype=np.int64),
+            np.array([avg_position], dtype=np.float64),
+            np.array([seed], dtype=np.uint64)
+        )
+        return positions.tolist()
+    
+    def _generate_positions_batch(self, impressions: np.ndarray, avg_positions: np.ndarray,
+                                  seeds: np.ndarray) -> np.ndarray:
+        """Генерация позиций сразу для многих строк.
+
+        Возвращает плоский массив: позиции строки i занимают impressions[i]
+        элементов подряд. Каждая позиция — min_pos + Binomial(max_pos - min_pos, p),
+        затем сумма позиций строки подгоняется к ceil(avg_position * impressions):
+        +1 к diff наименьшим позициям или -1 (не ниже 1) к |diff| наибольшим.
+
+        Случайность строки берется только из seeds[i], поэтому результат
+        строки не зависит от того, с какими строками она попала в пакет.
+        """
+        impressions = np.asarray(impressions, dtype=np.int64)
+        avg_positions = np.asarray(avg_positions, dtype=np.float64)
+        total = int(impressions.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        
+        sums_of_positions = np.ceil(avg_positions * impressions).astype(np.int64)
+        
+        min_pos = np.maximum(1, np.floor(avg_positions - 1.5)).astype(np.int64)
+        max_pos = np.ceil(avg_positions + 1.5).astype(np.int64)
+        trials = np.maximum(0, max_pos - min_pos)
         
-        min_pos = max(1, math.floor(avg_position - 1.5))
-        max_pos = math.ceil(avg_position + 1.5)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.clip((avg_positions - min_pos) / trials, 0.05, 0.95)
+        p = np.where(trials > 0, p, 0.05)
         
-        p = max(0.05, min(0.95, (avg_position - min_pos) / (max_pos - min_pos)))
+        # Номер строки для каждого показа и начало каждой строки в плоском массиве
+        segment = np.repeat(np.arange(len(impressions)), impressions)
+        starts = np.cumsum(impressions) - impressions
         
-        positions = []
-        for _ in range(impressions):
-            binomial_result = 0
-            for _ in range(max_pos - min_pos):
-                if np.random.random() < p:
-                    binomial_result += 1
-            position = min_pos + binomial_result
-            positions.append(int(position))
+        # Биномиальная величина как сумма испытаний Бернулли: испытание k показа j
+        # строки берет число с номером j * MAX_TRIALS + k из потока строки
+        local_index = (np.arange(total) - starts[segment]).astype(np.uint64)
+        element_seeds = seeds[segment]
+        element_trials = trials[segment]
+        element_p = p[segment]
+        successes = np.zeros(total, dtype=np.int64)
+        for k in range(MAX_TRIALS):
+            u = uniforms(element_seeds, local_index * np.uint64(MAX_TRIALS) + np.uint64(k))
+            successes += (k < element_trials) & (u < element_p)
+        
+        positions = min_pos[segment] + successes
         
         # Корректируем сумму
-        current_sum = sum(positions)
-        diff = sum_of_positions - current_sum
-        
-        if diff > 0:
-            sorted_indices = np.argsort(positions)
-            for i in range(min(diff, len(positions))):
-                positions[sorted_indices[i]] += 1
-        elif diff < 0:
-            sorted_indices = np.argsort(positions)[::-1]
-            for i in range(min(abs(diff), len(positions))):
-                positions[sorted_indices[i]] = max(1, positions[sorted_indices[i]] - 1)
+        current_sums = np.bincount(segment, weights=positions, minlength=len(impressions)).astype(np.int64)
+        diff = (sums_of_positions - current_sums)[segment]
+        
+        # Ранг позиции внутри своей строки по возрастанию
+        order = np.lexsort((positions, segment))
+        rank = np.empty(total, dtype=np.int64)
+        rank[order] = np.arange(total) - starts[segment[order]]
+        
+        increase = (diff > 0) & (rank < diff)
+        decrease = (diff < 0) & (rank >= impressions[segment] + diff)
         
+        positions = positions + increase
+        positions = np.where(decrease, np.maximum(1, positions - 1), positions)
         return positions
     
-    def transform(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         """Генерируем позиции для всех строк"""
         if df.empty:
-            return []
+            return pd.DataFrame()
         
         self.logger.info("🎲 Генерация позиций...")
         
-        all_positions = []
-        for _, row in df.iterrows():
-            row_id = int(row['id'])
-            impressions = int(row['impressions'])
-            avg_position = float(row['position'])
-            
-            positions = self._generate_positions_array(impressions, avg_position)
-            
-            # Сохраняем позиции с порядковыми номерами
-            for order, pos in enumerate(positions, 1):
-                all_positions.append({
-                    'id': row_id,
-                    'impression_position': int(pos),
-                    'impression_order': int(order)
-                })
+        impressions = df['impressions'].to_numpy(dtype=np.int64)
+        positions = self._generate_positions_batch(
+            impressions,
+            df['position'].to_numpy(dtype=np.float64),
+            row_seeds(self.seed, 'positions', df)
+        )
+        
+        # Порядковые номера показов внутри каждой строки начинаются с 1
+        starts = np.cumsum(impressions) - impressions
+        orders = np.arange(len(positions)) - np.repeat(starts, impressions) + 1
+        
+        all_positions = pd.DataFrame({
+            'id': np.repeat(df['id'].to_numpy(dtype=np.int64), impressions),
+            'impression_position': positions,
+            'impression_order': orders
+        })
         
         self.logger.info(f"🎯 Сгенерировано {len(all_positions)} позиций")
         return all_positions
     
-    def load(self, data: List[Dict[str, Any]]) -> int:
+    def load(self, data: pd.DataFrame) -> int:
         """Сохраняем позиции в БД"""
-        if not data:
+        if data.empty:
             return 0
         
         self.logger.info(f"💾 Сохранение {len(data)} позиций...")
         
-        with get_db() as db:
-            for item in data:
-                insert_query = text(f"""
-                INSERT INTO {self.target_table} 
-                (id, impression_position, impression_order)
-                VALUES (:id, :impression_position, :impression_order)
-                """)
-                
-                db.execute(insert_query, {
-                    'id': int(item['id']),
-                    'impression_position': int(item['impression_position']),
-                    'impression_order': int(item['impression_order'])
-                })
-        
-        return len(data)
\ No newline at end of file
+        return self.copy_frame(self.target_table, data, ['id', 'impression_position', 'impression_order'])
\ No newline at end of file
@@ -0,0 +1,39 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Натуральный ключ строки ppl.webmaster_aggregated
+NATURAL_KEY = ['date', 'query', 'page_path', 'device']
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def row_seeds(run_seed: int, stage: str, df: pd.DataFrame) -> np.ndarray:
+    """64-битные зерна строк из seed запуска, имени этапа и натурального ключа.
+
+    Зерно зависит только от самой строки, поэтому генерация любого
+    подмножества строк (другим чанком, шардом или повторным запуском)
+    дает те же значения.
+    """
+    prefix = f"{run_seed}\x1f{stage}".encode()
+    seeds = np.empty(len(df), dtype=np.uint64)
+    for i, key in enumerate(zip(*(df[column].tolist() for column in NATURAL_KEY))):
+        digest = hashlib.blake2b(prefix, digest_size=8)
+        for part in key:
+            digest.update(b"\x1f" + str(part).encode())
+        seeds[i] = int.from_bytes(digest.digest(), 'little')
+    return seeds
+
+
+def uniforms(seeds: np.ndarray, counters: np.ndarray) -> np.ndarray:
+    """Равномерные числа в (0, 1): counter-based SplitMix64 от (зерно строки, номер)"""
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    counters = np.asarray(counters, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        z = seeds + (counters + np.uint64(1)) * _GOLDEN_GAMMA
+        z = (z ^ (z >> np.uint64(30))) * _MIX_1
+        z = (z ^ (z >> np.uint64(27))) * _MIX_2
+        z = z ^ (z >> np.uint64(31))
+    return ((z >> np.uint64(11)).astype(np.float64) + 0.5) * (1.0 / 2 ** 53)
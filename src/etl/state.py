@@ -0,0 +1,167 @@
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.models.database import get_db, engine, ETLStageState, ETLProcessedLoad
+
+
+class ETLState:
+    """Состояние этапов ETL в таблицах ppl.etl_state и ppl.etl_processed_loads.
+
+    Новая работа этапа — записи журнала загрузок источника, которые этап
+    еще не отметил в etl_processed_loads. Запись журнала фиксируется в
+    одной транзакции со строками, поэтому поздно зафиксированная загрузка
+    или догруженная старая дата не теряются, как при одном максимальном
+    значении. В etl_state — статус последнего запуска и прогресс
+    (последняя обработанная дата или ID, число строк). Таблицы создает
+    create_tables() по моделям из src/models/database.py.
+    """
+
+    def __init__(self):
+        self.table = f"{ETLStageState.__table__.schema}.{ETLStageState.__tablename__}"
+        self.processed_table = f"{ETLProcessedLoad.__table__.schema}.{ETLProcessedLoad.__tablename__}"
+        # Соединения, на которых держатся advisory lock этапов
+        self._locks = {}
+
+    def _lock_key(self, stage: str) -> str:
+        return f"{self.table}:{stage}"
+
+    def try_lock(self, stage: str) -> bool:
+        """Берет advisory lock этапа без ожидания; False — этап уже выполняется.
+
+        Блокировка сессионная и держится на отдельном соединении до unlock(),
+        а при падении процесса Postgres снимает ее вместе с соединением.
+        """
+        connection = engine.connect()
+        try:
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_lock(hashtext(:key))"), {"key": self._lock_key(stage)}
+            ).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+        if not acquired:
+            connection.close()
+            return False
+        self._locks[stage] = connection
+        return True
+
+    def unlock(self, stage: str):
+        connection = self._locks.pop(stage, None)
+        if connection is None:
+            return
+        try:
+            connection.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": self._lock_key(stage)})
+            connection.commit()
+        except Exception:
+            # Соединение с неснятой блокировкой нельзя возвращать в пул
+            connection.invalidate()
+            raise
+        finally:
+            connection.close()
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        with get_db() as db:
+            row = db.execute(
+                text(f"SELECT * FROM {self.table} WHERE stage = :stage"), {"stage": stage}
+            ).mappings().fetchone()
+            return dict(row) if row else None
+
+    def start(self, stage: str, bootstrap: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+        """Отмечает начало запуска этапа и возвращает его водяной знак.
+
+        bootstrap(db) вызывается один раз, когда у этапа еще нет записи,
+        и возвращает начальные last_date/last_id по уже загруженным данным.
+        В ключе previous_status — статус предыдущего запуска.
+        """
+        with get_db() as db:
+            row = db.execute(
+                text(f"SELECT * FROM {self.table} WHERE stage = :stage FOR UPDATE"), {"stage": stage}
+            ).mappings().fetchone()
+
+            if row is None:
+                initial = bootstrap(db)
+                db.execute(text(f"""
+                    INSERT INTO {self.table} (stage, last_date, last_id)
+                    VALUES (:stage, :last_date, :last_id)
+                    ON CONFLICT (stage) DO NOTHING
+                """), {"stage": stage, "last_date": initial.get('last_date'), "last_id": initial.get('last_id')})
+                watermark = {'last_date': initial.get('last_date'), 'last_id': initial.get('last_id'),
+                             'previous_status': 'success'}
+            else:
+                watermark = {'last_date': row['last_date'], 'last_id': row['last_id'],
+                             'previous_status': row['status']}
+
+            db.execute(text(f"""
+                UPDATE {self.table}
+                SET status = 'running', started_at = now(), finished_at = NULL, updated_at = now()
+                WHERE stage = :stage
+            """), {"stage": stage})
+
+        return watermark
+
+    def advance(self, stage: str, last_date=None, last_id: int = None, rows: int = 0):
+        """Сдвигает водяной знак вперед после зафиксированной загрузки"""
+        with get_db() as db:
+            db.execute(text(f"""
+                UPDATE {self.table}
+                SET last_date = GREATEST(last_date, CAST(:last_date AS DATE)),
+                    last_id = GREATEST(last_id, CAST(:last_id AS BIGINT)),
+                    rows_processed = rows_processed + :rows,
+                    updated_at = now()
+                WHERE stage = :stage
+            """), {"stage": stage, "last_date": last_date, "last_id": last_id, "rows": rows})
+
+    def pending_loads(self, stage: str, loads_table: str, requires: str = None) -> List[Dict[str, Any]]:
+        """Записи журнала loads_table, которые этап еще не обработал.
+
+        requires — этап, который должен обработать запись раньше (клики ждут позиций).
+        """
+        query = f"""
+            SELECT l.* FROM {loads_table} l
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {self.processed_table} p WHERE p.stage = :stage AND p.load_id = l.load_id
+            )
+        """
+        if requires is not None:
+            query += f"""
+              AND EXISTS (
+                SELECT 1 FROM {self.processed_table} p WHERE p.stage = :requires AND p.load_id = l.load_id
+            )
+            """
+        with get_db() as db:
+            rows = db.execute(text(query + " ORDER BY l.load_id"),
+                              {"stage": stage, "requires": requires}).mappings().fetchall()
+            return [dict(row) for row in rows]
+
+    def mark_processed(self, stage: str, load_ids: List[int], db=None):
+        """Отмечает записи журнала обработанными; с db — в транзакции вызывающего"""
+        if not load_ids:
+            return
+        statement = text(f"""
+            INSERT INTO {self.processed_table} (stage, load_id)
+            SELECT :stage, unnest(CAST(:load_ids AS BIGINT[]))
+            ON CONFLICT DO NOTHING
+        """)
+        params = {"stage": stage, "load_ids": [int(load_id) for load_id in load_ids]}
+        if db is not None:
+            db.execute(statement, params)
+            return
+        with get_db() as db:
+            db.execute(statement, params)
+
+    def finish(self, stage: str, status: str = 'success'):
+        with get_db() as db:
+            db.execute(text(f"""
+                UPDATE {self.table}
+                SET status = :status, finished_at = now(), updated_at = now()
+                WHERE stage = :stage
+            """), {"stage": stage, "status": status})
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        with get_db() as db:
+            rows = db.execute(text(f"SELECT * FROM {self.table} ORDER BY stage")).mappings().fetchall()
+            return {row['stage']: dict(row) for row in rows}
@@ -1,23 +1,28 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, Float, Text
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Date, DateTime, Float, Text, Index, Sequence, func, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
-from typing import Generator
+from typing import Generator, List
+from datetime import date, timedelta
 from sqlalchemy import PrimaryKeyConstraint
 
 import sys
 from pathlib import Path
+from loguru import logger
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from config.settings import settings
 
 Base = declarative_base()
 
+# Схемы, которыми владеет проект
+SCHEMAS = ('rdl', 'ppl')
+
 class WebmasterData(Base):
     """Модель для данных Яндекс.Вебмастер"""
     __tablename__ = 'webmaster'  # Имя таблицы в БД
     __table_args__ = (
         PrimaryKeyConstraint('date', 'page_path', 'query', 'device'),
-        {'schema': 'rdl'}  # Схема в БД
+        {'schema': 'rdl', 'postgresql_partition_by': 'RANGE (date)'}  # Схема в БД, секции по месяцам
     )
 
     date = Column(Date, nullable=False)
@@ -32,6 +37,111 @@ class WebmasterData(Base):
     def __repr__(self):
         return f"<WebmasterData(date={self.date}, query={self.query[:30]}..., device={self.device})>"
 
+# id новых строк ppl.webmaster_aggregated. У таблицы, созданной до появления
+# последовательности, ее создает AggregatedETL со стартом после MAX(id)
+AGGREGATED_ID_SEQUENCE = Sequence('webmaster_aggregated_id_seq', schema='ppl')
+
+class WebmasterAggregated(Base):
+    """Очищенные данные Вебмастера с суррогатным id"""
+    __tablename__ = 'webmaster_aggregated'
+    __table_args__ = (
+        # Ключ секционированной таблицы обязан включать date
+        PrimaryKeyConstraint('id', 'date'),
+        Index('ix_webmaster_aggregated_natural_key', 'date', 'query', 'page_path', 'device', unique=True),
+        {'schema': 'ppl', 'postgresql_partition_by': 'RANGE (date)'}
+    )
+
+    id = Column(BigInteger, AGGREGATED_ID_SEQUENCE, server_default=AGGREGATED_ID_SEQUENCE.next_value(),
+                nullable=False)
+    date = Column(Date, nullable=False)
+    query = Column(Text, nullable=False)
+    page_path = Column(Text, nullable=False)
+    device = Column(String(20), nullable=False)
+    demand = Column(Integer, nullable=False)
+    impressions = Column(Integer, nullable=False)
+    clicks = Column(Integer, nullable=False)
+    position = Column(Float, nullable=False)
+
+# У positions и clicks нет даты, поэтому они не секционируются, а получают
+# индексы под выборки по id. Ключ в __mapper_args__ нужен только ORM.
+class WebmasterPositions(Base):
+    """Сгенерированные позиции показов"""
+    __tablename__ = 'webmaster_positions'
+    __table_args__ = (
+        Index('ix_webmaster_positions_id_order', 'id', 'impression_order'),
+        {'schema': 'ppl'}
+    )
+    __mapper_args__ = {'primary_key': ['id', 'impression_order']}
+
+    id = Column(BigInteger, nullable=False)
+    impression_position = Column(Integer, nullable=False)
+    impression_order = Column(Integer, nullable=False)
+
+class WebmasterClicks(Base):
+    """Сгенерированные клики; один показ может получить несколько кликов"""
+    __tablename__ = 'webmaster_clicks'
+    __table_args__ = (
+        Index('ix_webmaster_clicks_id', 'id'),
+        {'schema': 'ppl'}
+    )
+    __mapper_args__ = {'primary_key': ['id', 'impression_order']}
+
+    id = Column(BigInteger, nullable=False)
+    click_position = Column(Integer, nullable=False)
+    impression_order = Column(Integer, nullable=False)
+
+# Журналы загрузок пишутся в той же транзакции, что и строки, поэтому запись
+# журнала становится видна вместе с данными, в каком бы порядке ни
+# фиксировались параллельные загрузки. ETL ищет новые данные по
+# необработанным записям журнала, а не по максимальной дате или id.
+class WebmasterLoad(Base):
+    """Журнал загрузок rdl.webmaster: дата каждой транзакции с новыми строками"""
+    __tablename__ = 'webmaster_loads'
+    __table_args__ = {'schema': 'rdl'}
+
+    load_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    date = Column(Date, nullable=False)
+    loaded_at = Column(DateTime, nullable=False, server_default=func.now())
+
+class WebmasterAggregatedLoad(Base):
+    """Журнал загрузок ppl.webmaster_aggregated: диапазон id каждой транзакции"""
+    __tablename__ = 'webmaster_aggregated_loads'
+    __table_args__ = {'schema': 'ppl'}
+
+    load_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id_from = Column(BigInteger, nullable=False)
+    id_to = Column(BigInteger, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    date_from = Column(Date)
+    date_to = Column(Date)
+    loaded_at = Column(DateTime, nullable=False, server_default=func.now())
+
+class ETLStageState(Base):
+    """Статус последнего запуска и прогресс этапа ETL"""
+    __tablename__ = 'etl_state'
+    __table_args__ = {'schema': 'ppl'}
+
+    stage = Column(Text, primary_key=True)
+    last_date = Column(Date)
+    last_id = Column(BigInteger)
+    status = Column(Text, nullable=False, server_default='idle')
+    rows_processed = Column(BigInteger, nullable=False, server_default='0')
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+class ETLProcessedLoad(Base):
+    """Записи журналов загрузок, обработанные этапом ETL"""
+    __tablename__ = 'etl_processed_loads'
+    __table_args__ = {'schema': 'ppl'}
+
+    stage = Column(Text, primary_key=True)
+    load_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    processed_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# Таблицы, секционированные по месяцам на date
+PARTITIONED_TABLES = (WebmasterData.__table__, WebmasterAggregated.__table__)
+
 # Создаем движок базы данных
 engine = create_engine(
     settings.db.connection_string,
@@ -56,6 +166,124 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _create_month_partition(conn, table, partition: str, month: date):
+    """Создает секцию месяца; строки этого месяца из DEFAULT-секции переносятся в нее.
+
+    PARTITION OF не сработает, если в DEFAULT уже есть строки диапазона, поэтому
+    в этом случае секция создается отдельной таблицей и подключается после переноса.
+    """
+    parent = f"{table.schema}.{table.name}"
+    bounds = {"month_from": month, "month_to": _add_months(month, 1)}
+    default = f"{table.schema}.{table.name}_default"
+    has_default_rows = False
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": default}).scalar():
+        has_default_rows = conn.execute(text(f"""
+            SELECT EXISTS (SELECT 1 FROM {default} WHERE date >= :month_from AND date < :month_to)
+        """), bounds).scalar()
+    
+    if not has_default_rows:
+        conn.execute(text(f"""
+            CREATE TABLE {table.schema}.{partition} PARTITION OF {parent}
+            FOR VALUES FROM ('{month}') TO ('{bounds['month_to']}')
+        """))
+        return
+    
+    conn.execute(text(f"CREATE TABLE {table.schema}.{partition} (LIKE {parent} INCLUDING DEFAULTS)"))
+    moved = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {default} WHERE date >= :month_from AND date < :month_to RETURNING *
+        )
+        INSERT INTO {table.schema}.{partition} SELECT * FROM moved
+    """), bounds).rowcount
+    conn.execute(text(f"""
+        ALTER TABLE {parent} ATTACH PARTITION {table.schema}.{partition}
+        FOR VALUES FROM ('{month}') TO ('{bounds['month_to']}')
+    """))
+    logger.info(f"Из {default} в {table.schema}.{partition} перенесено строк: {moved}")
+
+def ensure_partitions(start: date = None, months_ahead: int = None) -> List[str]:
+    """Создает месячные секции от месяца start до months_ahead месяцев вперед.
+
+    По умолчанию start — начало окна DAYS_BACK, months_ahead — PARTITION_MONTHS_AHEAD.
+    У каждой таблицы есть DEFAULT-секция: строка с датой вне созданных секций
+    (например, при загрузке старой даты в обход бэкфилла) попадает туда, а не
+    обрывает загрузку ошибкой. Таблицы, созданные до секционирования (обычные
+    heap-таблицы), пропускаются. Возвращает имена созданных секций.
+    """
+    start = start or date.today() - timedelta(days=settings.app.days_back)
+    if months_ahead is None:
+        months_ahead = settings.app.partition_months_ahead
+    first = start.replace(day=1)
+    last = _add_months(date.today().replace(day=1), months_ahead)
+    
+    created = []
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            parent = f"{table.schema}.{table.name}"
+            is_partitioned = conn.execute(text(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:parent)"
+            ), {"parent": parent}).scalar()
+            if not is_partitioned:
+                continue
+            
+            month = first
+            while month <= last:
+                partition = f"{table.name}_p{month:%Y_%m}"
+                exists = conn.execute(text("SELECT to_regclass(:name)"),
+                                      {"name": f"{table.schema}.{partition}"}).scalar()
+                if not exists:
+                    _create_month_partition(conn, table, partition, month)
+                    created.append(f"{table.schema}.{partition}")
+                month = _add_months(month, 1)
+            
+            default = f"{table.name}_default"
+            exists = conn.execute(text("SELECT to_regclass(:name)"),
+                                  {"name": f"{table.schema}.{default}"}).scalar()
+            if not exists:
+                conn.execute(text(f"CREATE TABLE {table.schema}.{default} PARTITION OF {parent} DEFAULT"))
+                created.append(f"{table.schema}.{default}")
+    
+    return created
+
+def _duplicate_keys(conn, index: Index) -> List[tuple]:
+    """Ключи уникального индекса, которые повторяются в таблице (не больше 5 примеров и их число)"""
+    table = index.table
+    columns = ', '.join(column.name for column in index.columns)
+    rows = conn.execute(text(f"""
+        SELECT {columns}, COUNT(*) AS copies, COUNT(*) OVER () AS total
+        FROM {table.schema}.{table.name}
+        GROUP BY {columns}
+        HAVING COUNT(*) > 1
+        LIMIT 5
+    """)).fetchall()
+    return [tuple(row) for row in rows]
+
 def create_tables():
-    """Создает таблицы в БД (если нужно)"""
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    """Создает схемы, таблицы, индексы и ближайшие секции (если нужно)"""
+    with engine.begin() as conn:
+        for schema in SCHEMAS:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+    Base.metadata.create_all(bind=engine)
+    
+    # create_all не трогает существующие таблицы, индексы для них создаем отдельно.
+    # Уникальный индекс на таблице с дубликатами не построится, поэтому такие
+    # дубликаты только выводятся в лог, а запуск продолжается без индекса
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.unique:
+                with engine.connect() as conn:
+                    exists = conn.execute(text("SELECT to_regclass(:name)"),
+                                          {"name": f"{table.schema}.{index.name}"}).scalar()
+                    duplicates = [] if exists else _duplicate_keys(conn, index)
+                if duplicates:
+                    logger.warning(f"Индекс {index.name} не создан: в {table.schema}.{table.name} "
+                                   f"{duplicates[0][-1]} повторяющихся ключей, например {duplicates[0][:-2]} "
+                                   f"({duplicates[0][-2]} копий); удалите дубликаты и перезапустите")
+                    continue
+            index.create(bind=engine, checkfirst=True)
+    
+    return ensure_partitions()
\ No newline at end of file
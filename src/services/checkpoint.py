@@ -0,0 +1,78 @@
+from typing import Set, Tuple
+import json
+import threading
+from pathlib import Path
+
+
+class BackfillCheckpoint:
+    """Журнал прогресса бэкфилла в JSONL-файле (только дозапись).
+
+    Строка {"date": ..., "started": true} пишется до первой вставки за дату,
+    {"date": ..., "url": ..., "device": ...} — сохраненная пара URL × устройство,
+    {"date": ...} — дата загружена целиком. При повторном запуске с тем же
+    диапазоном готовые даты и пары пропускаются.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done_dates: Set[str] = set()
+        self.done_tasks: Set[Tuple[str, str, str]] = set()
+        self.started: Set[str] = set()
+        self.torn_tail = False
+        self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    self.torn_tail = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Строка, оборванная при аварийной остановке
+                        continue
+                    if 'url' in entry:
+                        self.done_tasks.add((entry['date'], entry['url'], entry['device']))
+                    elif entry.get('started'):
+                        self.started.add(entry['date'])
+                    else:
+                        self.done_dates.add(entry['date'])
+        except OSError:
+            pass
+
+    def _append(self, entry: dict):
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.torn_tail:
+                    f.write('\n')
+                    self.torn_tail = False
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def started_dates(self) -> Set[str]:
+        """Даты, которые бэкфилл начал загружать, даже если ни одна пара не отмечена"""
+        with self.lock:
+            return self.started | {task[0] for task in self.done_tasks}
+
+    def mark_started(self, date_str: str):
+        """Отметка до первой вставки: строки, сохраненные до аварии, не сделают
+        дату загруженной для обычной синхронизации"""
+        if date_str in self.started:
+            return
+        self._append({'date': date_str, 'started': True})
+        with self.lock:
+            self.started.add(date_str)
+
+    def is_task_done(self, date_str: str, url: str, device: str) -> bool:
+        return (date_str, url, device) in self.done_tasks
+
+    def mark_task(self, date_str: str, url: str, device: str):
+        self._append({'date': date_str, 'url': url, 'device': device})
+        with self.lock:
+            self.done_tasks.add((date_str, url, device))
+
+    def mark_date(self, date_str: str):
+        self._append({'date': date_str})
+        with self.lock:
+            self.done_dates.add(date_str)
@@ -1,63 +1,271 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import queue
 import sys
+import threading
 from pathlib import Path
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from src.models.database import get_db, WebmasterData
-from src.api.webmaster_client import WebmasterClient
+from config.settings import settings
+from src.models.database import get_db, WebmasterData, WebmasterLoad
+from src.api.webmaster_client import WebmasterClient, parse_query_rows
+from src.api.raw_archive import RawArchive
+from src.services.checkpoint import BackfillCheckpoint
+from src.utils.metrics import metrics
+from src.utils.logger import ProgressReporter
+
+
+# Маркер завершения задачи URL × устройство в очереди результатов
+_TaskDone = namedtuple('_TaskDone', ['url', 'device', 'pages'])
 
 
 class DataLoader:
     def __init__(self, client: WebmasterClient):
         self.client = client
+        self.logger = logger
         self.device_types = ['DESKTOP', 'MOBILE', 'TABLET']
+        self.fetch_workers = settings.app.fetch_workers
+        self.extraction_strategy = settings.app.extraction_strategy
+        self.batch_size = settings.app.batch_size
+        self.raw_archive = RawArchive(settings.app.data_dir / 'raw')
+    
+    def load_data_for_date(self, target_date: str, checkpoint: Optional[BackfillCheckpoint] = None) -> int:
+        """Загрузка всех пар URL × устройство за дату.
+
+        С checkpoint пары, сохраненные прошлым запуском, пропускаются, а каждая
+        новая пара отмечается после фиксации ее строк в БД.
+        """
+        self.logger.info(f"Загрузка данных за {target_date}...")
+        
+        tasks = self._build_tasks(target_date)
+        
+        if checkpoint is not None:
+            pending = [(url, device) for url, device in tasks
+                       if not checkpoint.is_task_done(target_date, url, device)]
+            if len(pending) < len(tasks):
+                self.logger.info(f"Пропущено уже загруженных пар URL × устройство: {len(tasks) - len(pending)}")
+            tasks = pending
+        
+        self._reset_state(target_date, checkpoint, total=len(tasks))
+        
+        if not tasks:
+            self.logger.info(f"Нет URL с данными за {target_date}")
+            if checkpoint is not None:
+                checkpoint.mark_date(target_date)
+            return 0
+        
+        if checkpoint is not None:
+            checkpoint.mark_started(target_date)
+        
+        if self.fetch_workers > 1:
+            total_records = self._load_concurrently(target_date, tasks)
+        else:
+            total_records = 0
+            for url, device in tasks:
+                pages = 0
+                for records in self.client.iter_query_pages(target_date, url, device):
+                    pages += 1
+                    total_records += self._buffer_records(records)
+                self._record_pages(_TaskDone(url, device, pages))
+            total_records += self._flush_records()
+        
+        self.progress.finish()
+        self.logger.info(f"Загружено {total_records} записей за {target_date}")
+        if checkpoint is not None and self.save_errors == 0:
+            checkpoint.mark_date(target_date)
+        self._print_page_stats()
+        stats = self.client.connection_stats()
+        self.logger.info(f"HTTP: {stats['requests']} запросов, {stats['connections']} соединений, {stats['reused']} переиспользовано")
+        return total_records
+    
+    def replay_date(self, target_date: str) -> int:
+        """Загрузка даты из архива сырых ответов data/raw без обращений к API.
+
+        Ответы разбираются тем же parse_query_rows, что и при загрузке из
+        API, поэтому результат совпадает с исходной загрузкой.
+        """
+        self.logger.info(f"Загрузка данных за {target_date} из архива...")
+        self._reset_state(target_date)
+        self.progress = ProgressReporter(f"{target_date}: страницы архива")
+        
+        total_records = 0
+        for entry in self.raw_archive.read('queries', target_date):
+            stats_list = entry['response'].get('text_indicator_to_statistics', [])
+            records = parse_query_rows(stats_list, target_date, entry['url'], entry['device'])
+            key = (entry['url'], entry['device'])
+            self.page_stats[key] = self.page_stats.get(key, 0) + 1
+            self.progress.update()
+            total_records += self._buffer_records(records)
+        total_records += self._flush_records()
+        
+        self.progress.finish()
+        self.logger.info(f"Загружено {total_records} записей за {target_date}")
+        self._print_page_stats()
+        return total_records
+    
+    def _reset_state(self, target_date: str, checkpoint: Optional[BackfillCheckpoint] = None,
+                     total: Optional[int] = None):
+        self.page_stats = {}
+        self.pending_records = []
+        self.checkpoint = checkpoint
+        self.target_date = target_date
+        self.unsaved_tasks = []
+        self.save_errors = 0
+        self.progress = ProgressReporter(f"{target_date}: пары URL × устройство", total=total)
     
-    def load_data_for_date(self, target_date: str) -> int:
-        print(f"Загрузка данных за {target_date}...")
+    def _build_tasks(self, target_date: str) -> List[Tuple[str, str]]:
+        """Список пар URL × устройство для опроса"""
+        if self.extraction_strategy == 'pairs':
+            tasks = self.client.get_url_device_pairs(target_date, self.device_types)
+            by_url = {}
+            for url, device in tasks:
+                by_url.setdefault(url, []).append(device)
+            self.logger.info(f"Найдено {len(by_url)} URL, {len(tasks)} непустых пар URL × устройство")
+            # Группируем по URL, чтобы устройства одной страницы шли подряд
+            return [(url, device) for url, devices in by_url.items() for device in devices]
         
         # Получаем все URL для даты
         urls = self.client.get_urls_for_date(target_date)
-        print(f"Найдено {len(urls)} URL для обработки")
+        self.logger.info(f"Найдено {len(urls)} URL для обработки")
+        return [(url, device) for url in urls for device in self.device_types]
+    
+    def _load_concurrently(self, target_date: str, tasks: List[Tuple[str, str]]) -> int:
+        """Параллельная загрузка пар URL × устройство.
+
+        Запросы к API выполняются в пуле потоков, а готовые ответы сразу
+        сохраняются в текущем потоке, поэтому сетевые задержки перекрываются
+        записью в БД. Очередь ограничена, чтобы память не росла, если
+        запись отстает от сети. После первой ошибки оставшиеся запросы
+        отменяются: дата все равно будет повторена целиком.
+        """
+        results = queue.Queue(maxsize=self.fetch_workers * 2)
+        cancel = threading.Event()
         
-        if not urls:
-            print(f"Нет URL с данными за {target_date}")
-            return 0
+        def put(item):
+            # После отмены очередь никто не читает, поэтому put не должен ждать вечно
+            while not cancel.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+        
+        def fetch(url: str, device: str):
+            pages = 0
+            try:
+                # Страницы уходят в очередь по мере получения
+                for records in self.client.iter_query_pages(target_date, url, device):
+                    if cancel.is_set():
+                        return
+                    pages += 1
+                    put(records)
+                put(_TaskDone(url, device, pages))
+            except Exception as e:
+                put(e)
         
         total_records = 0
+        finished = 0
         
-        for url in urls:
-            for device in self.device_types:
-                records = self.client.get_queries_for_url_and_date(target_date, url, device)
-                saved = self._save_records(records)
-                total_records += saved
+        executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        try:
+            for url, device in tasks:
+                executor.submit(fetch, url, device)
+            
+            while finished < len(tasks):
+                item = results.get()
+                if isinstance(item, Exception):
+                    raise item
+                elif isinstance(item, _TaskDone):
+                    self._record_pages(item)
+                    finished += 1
+                else:
+                    total_records += self._buffer_records(item)
+        finally:
+            cancel.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            # Освобождаем память страниц, которые уже не будут сохранены
+            while not results.empty():
+                results.get_nowait()
+            # Строки завершенных пар сохраняем и при ошибке: их не придется запрашивать снова
+            total_records += self._flush_records()
         
-        print(f"Загружено {total_records} записей за {target_date}")
         return total_records
     
+    def _record_pages(self, done: _TaskDone):
+        self.page_stats[(done.url, done.device)] = done.pages
+        # Строки пары уже в буфере: отметим ее после ближайшего сохранения
+        self.unsaved_tasks.append(done)
+        self.progress.update(pages=done.pages)
+        if done.pages > 1:
+            self.logger.debug(f"{done.url} [{done.device}]: {done.pages} страниц запросов")
+    
+    def _print_page_stats(self):
+        if not self.page_stats:
+            return
+        total_pages = sum(self.page_stats.values())
+        paginated = sum(1 for pages in self.page_stats.values() if pages > 1)
+        self.logger.info(f"Страниц запросов: {total_pages}, URL × устройство с пагинацией: {paginated}, "
+                         f"максимум страниц: {max(self.page_stats.values())}")
+    
+    def _buffer_records(self, records: List[Dict[str, Any]]) -> int:
+        """Копит строки страниц и сохраняет их пакетами по BATCH_SIZE"""
+        self.pending_records.extend(records)
+        if len(self.pending_records) < self.batch_size:
+            return 0
+        return self._flush_records()
+    
+    def _flush_records(self) -> int:
+        records, self.pending_records = self.pending_records, []
+        tasks, self.unsaved_tasks = self.unsaved_tasks, []
+        saved_count = self._save_records(records)
+        if saved_count:
+            self.progress.update(0, saved=saved_count)
+        # Страницы пары могут попасть в несколько пакетов, поэтому после любой
+        # ошибки сохранения за дату пары не отмечаются: дата повторится целиком
+        if self.checkpoint is not None and self.save_errors == 0:
+            for done in tasks:
+                self.checkpoint.mark_task(self.target_date, done.url, done.device)
+        return saved_count
+    
     def _save_records(self, records: List[Dict[str, Any]]) -> int:
         if not records:
             return 0
         
         saved_count = 0
         try:
-            with get_db() as db:
-                for record_data in records:
-                    # Проверяем дубликаты
-                    exists = db.query(WebmasterData).filter(
-                        WebmasterData.date == record_data['date'],
-                        WebmasterData.page_path == record_data['page_path'],
-                        WebmasterData.query == record_data['query'],
-                        WebmasterData.device == record_data['device']
-                    ).first()
-                    
-                    if not exists:
-                        record = WebmasterData(**record_data)
-                        db.add(record)
-                        saved_count += 1
-                
-                print(f"Добавлено {saved_count} новых записей")
-                
+            saved_count, skipped_count = self._bulk_insert(records)
+            self.logger.debug(f"Добавлено {saved_count} новых записей, пропущено дубликатов: {skipped_count}")
         except Exception as e:
-            print(f"Ошибка при сохранении: {e}")
+            self.save_errors += 1
+            self.logger.error(f"Ошибка при сохранении: {e}")
         
         return saved_count
+    
+    def _bulk_insert(self, records: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Пакетная вставка с INSERT ... ON CONFLICT DO NOTHING.
+
+        Дубликаты отсекает первичный ключ (date, page_path, query, device),
+        поэтому на пакет из BATCH_SIZE строк уходит один запрос вместо
+        проверки каждой строки. Вместе со строками пишется запись журнала
+        rdl.webmaster_loads. Возвращает (вставлено, пропущено).
+        """
+        inserted = 0
+        with metrics.timer('loader_db_write', table='rdl.webmaster') as timing:
+            with get_db() as db:
+                for start in range(0, len(records), self.batch_size):
+                    batch = records[start:start + self.batch_size]
+                    stmt = insert(WebmasterData).values(batch).on_conflict_do_nothing(
+                        index_elements=['date', 'page_path', 'query', 'device']
+                    )
+                    inserted += db.execute(stmt).rowcount
+                # Запись журнала в той же транзакции: ETL увидит загрузку только вместе со строками
+                if inserted:
+                    dates = sorted({record['date'] for record in records})
+                    db.execute(insert(WebmasterLoad).values([{'date': d} for d in dates]))
+            timing.rows = inserted
+        
+        metrics.inc('loader_duplicate_rows_total', len(records) - inserted)
+        return inserted, len(records) - inserted
@@ -1,50 +1,167 @@
-from typing import List, Set
+from typing import List, Set, Dict, Optional
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
 import sys
 from pathlib import Path
+from loguru import logger
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from config.settings import settings
 from src.models.database import get_db, WebmasterData
-from src.api.webmaster_client import WebmasterClient
+from src.api.webmaster_client import WebmasterClient, WebmasterAPIError
+
+
+class DateProbeCache:
+    """Кэш результатов проверки дат в API с TTL, хранится в JSON-файле"""
+    
+    def __init__(self, path: Path, ttl: int):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = self._read()
+    
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def get(self, date_str: str) -> Optional[bool]:
+        entry = self.entries.get(date_str)
+        if entry is None or time.time() - entry['checked_at'] > self.ttl:
+            return None
+        return entry['available']
+    
+    def set(self, date_str: str, available: bool):
+        with self.lock:
+            self.entries[date_str] = {'available': available, 'checked_at': time.time()}
+    
+    def save(self, keep_dates: Set[str]):
+        """Сохраняет кэш, оставляя только даты из текущего окна"""
+        with self.lock:
+            self.entries = {d: e for d, e in self.entries.items() if d in keep_dates}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            tmp_path.replace(self.path)
+
+
+class IncompleteDates:
+    """Даты, загрузка которых началась, но не завершилась, в JSON-файле.
+
+    Дата отмечается до первой вставки и снимается после успешной загрузки.
+    Если загрузка прервалась (ошибка API, ошибка сохранения или аварийная
+    остановка), в БД остаются строки части пар URL × устройство, и без этой
+    отметки дата считалась бы загруженной.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.dates = self._read()
+
+    def _read(self) -> Set[str]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sorted(self.dates), f, indent=2)
+        tmp_path.replace(self.path)
+
+    def all(self) -> Set[str]:
+        with self.lock:
+            return set(self.dates)
+
+    def add(self, date_str: str):
+        with self.lock:
+            self.dates.add(date_str)
+            self._save()
+
+    def discard(self, date_str: str):
+        with self.lock:
+            if date_str in self.dates:
+                self.dates.discard(date_str)
+                self._save()
 
 
 class DateManager:
     def __init__(self, client: WebmasterClient):
         self.client = client
+        self.logger = logger
+        self.cache = DateProbeCache(
+            settings.app.data_dir / 'processed' / 'date_probe_cache.json',
+            settings.app.date_cache_ttl
+        )
+        self.incomplete = IncompleteDates(settings.app.data_dir / 'processed' / 'incomplete_dates.json')
+        self.probe_workers = settings.app.fetch_workers
         
-    def get_existing_dates(self) -> Set[str]:
+    def get_existing_dates(self, since=None) -> Set[str]:
         existing_dates = set()
         try:
             with get_db() as db:
-                dates = db.query(WebmasterData.date).distinct().all()
+                query = db.query(WebmasterData.date)
+                if since is not None:
+                    query = query.filter(WebmasterData.date >= since)
+                dates = query.distinct().all()
                 existing_dates = {date[0].strftime('%Y-%m-%d') for date in dates}
         except Exception as e:
-            print(f"Error getting dates from DB: {e}")
+            self.logger.error(f"Error getting dates from DB: {e}")
         return existing_dates
     
     def get_missing_dates(self) -> List[str]:
-        existing_dates = self.get_existing_dates()
-        
         # Генерируем последние N дней
         days_back = settings.app.days_back
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=days_back - 1)
         
+        # Незавершенные даты есть в БД, но загружены не полностью
+        incomplete_dates = self.incomplete.all()
+        existing_dates = self.get_existing_dates(since=start_date) - incomplete_dates
+
         all_dates = []
         current_date = start_date
         while current_date <= end_date:
             all_dates.append(current_date.strftime('%Y-%m-%d'))
             current_date += timedelta(days=1)
         
+        # Даты из БД и из кэша в API не проверяем
+        candidates = [date for date in all_dates if date not in existing_dates]
+        cached = {date: True if date in incomplete_dates else self.cache.get(date) for date in candidates}
+        to_probe = [date for date in candidates if cached[date] is None]
+        
         # Проверяем какие даты есть в API
-        available_dates = []
-        for date_str in all_dates:
-            if self.client.check_date_has_data(date_str):
-                available_dates.append(date_str)
+        if to_probe:
+            with ThreadPoolExecutor(max_workers=max(1, self.probe_workers)) as executor:
+                for date_str, available in zip(to_probe, executor.map(self._probe_date, to_probe)):
+                    cached[date_str] = available
+        
+        self.cache.save(set(all_dates))
         
         # Находим недостающие
-        missing_dates = [date for date in available_dates if date not in existing_dates]
+        missing_dates = [date for date in candidates if cached[date]]
         
-        print(f"Статистика: {len(available_dates)} доступно, {len(existing_dates)} в БД, {len(missing_dates)} отсутствует")
-        return missing_dates
\ No newline at end of file
+        self.logger.info(f"Статистика: {len(existing_dates)} в БД, {len(to_probe)} проверено в API, "
+                         f"{len(candidates) - len(to_probe)} из кэша, {len(missing_dates)} отсутствует "
+                         f"(из них незавершенных: {len(incomplete_dates & set(missing_dates))})")
+        return missing_dates
+    
+    def _probe_date(self, date_str: str) -> Optional[bool]:
+        """Проверка даты в API; ошибки не кэшируются"""
+        try:
+            available = self.client.check_date_has_data(date_str)
+        except WebmasterAPIError as e:
+            self.logger.warning(f"Не удалось проверить дату {date_str}: {e}")
+            return None
+        self.cache.set(date_str, available)
+        return available
\ No newline at end of file
@@ -1,4 +1,6 @@
 import sys
+import threading
+import time
 from pathlib import Path
 from loguru import logger
 
@@ -6,7 +8,12 @@ from config.settings import settings
 
 
 def setup_logger():
-    """Настройка логирования"""
+    """Настройка логирования.
+
+    Оба обработчика работают через очередь (enqueue=True): вызов logger
+    только кладет сообщение в очередь, а запись в stdout и файл идет в
+    фоновом потоке, поэтому вывод не тормозит циклы загрузки.
+    """
     log_path = Path("logs")
     log_path.mkdir(exist_ok=True)
     
@@ -18,7 +25,8 @@ def setup_logger():
         sys.stdout,
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
         level=settings.app.log_level,
-        colorize=True
+        colorize=True,
+        enqueue=True
     )
     
     # Файловый вывод
@@ -28,7 +36,59 @@ def setup_logger():
         level=settings.app.log_level,
         rotation="00:00",
         retention="30 days",
-        compression="zip"
+        compression="zip",
+        serialize=settings.app.log_serialize,
+        enqueue=True
     )
     
-    return logger
\ No newline at end of file
+    return logger
+
+
+class ProgressReporter:
+    """Прогресс длинного цикла с ограничением частоты вывода.
+
+    update() вызывается на каждый элемент, а строка в лог пишется не
+    чаще, чем раз в every элементов или раз в interval секунд — что
+    наступит раньше. Потокобезопасен.
+    """
+    
+    def __init__(self, name: str, total: int = None, every: int = None, interval: float = None):
+        self.name = name
+        self.total = total
+        self.every = every or settings.app.progress_every
+        self.interval = interval if interval is not None else settings.app.progress_interval
+        self.done = 0
+        self.counters = {}
+        self.started = time.monotonic()
+        self.last_logged_at = self.started
+        self.last_logged_done = 0
+        self.lock = threading.Lock()
+    
+    def update(self, count: int = 1, **counters):
+        """Отмечает count готовых элементов; counters суммируются (например, rows=...)"""
+        with self.lock:
+            self.done += count
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            now = time.monotonic()
+            if self.done - self.last_logged_done < self.every and now - self.last_logged_at < self.interval:
+                return
+            self.last_logged_at = now
+            self.last_logged_done = self.done
+            message = self._format(now)
+        # depth=1: в логе место вызова update()/finish(), а не этого модуля
+        logger.opt(depth=1).info(message)
+    
+    def finish(self):
+        with self.lock:
+            message = self._format(time.monotonic())
+        logger.opt(depth=1).info(message)
+    
+    def _format(self, now: float) -> str:
+        elapsed = now - self.started
+        progress = f"{self.done}/{self.total}" if self.total else f"{self.done}"
+        if self.total:
+            progress += f" ({100 * self.done / self.total:.0f}%)"
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        extra = ''.join(f", {key}: {value}" for key, value in self.counters.items())
+        return f"{self.name}: {progress}, {rate:.1f}/с{extra}"
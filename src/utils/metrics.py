@@ -0,0 +1,235 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from config.settings import settings
+
+# Границы корзин гистограмм по умолчанию, секунд
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "webmaster_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Dict[str, str] = None) -> str:
+    pairs = list(labels) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Timing:
+    """Результат одного замера фазы; rows и bytes заполняет код внутри timer()"""
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def record(self, result):
+        """Берет rows/bytes из результата фазы: DataFrame или число строк"""
+        if hasattr(result, 'memory_usage'):
+            self.rows = len(result)
+            self.bytes = int(result.memory_usage(index=False).sum()) if len(result.columns) else 0
+        elif isinstance(result, int):
+            self.rows = result
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по верхней границе корзины"""
+        if self.count == 0:
+            return None
+        threshold = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    """Метрики одного запуска: фазы (время, строки, байты), счетчики и гистограммы.
+
+    Потокобезопасен; экспортируется в textfile для node_exporter
+    (формат Prometheus) и в JSON-сводку запуска.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.phases: Dict[Tuple[str, Labels], Dict[str, float]] = {}
+            self.counters: Dict[Tuple[str, Labels], float] = {}
+            self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+            self.annotations: Dict[str, Any] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def annotate(self, key: str, value: Any):
+        """Произвольные данные для JSON-сводки (например, горячие точки профиля)"""
+        with self.lock:
+            self.annotations[key] = value
+
+    def annotate_entry(self, key: str, name: str, value: Any):
+        """Добавляет запись name в словарь annotations[key]; чтение и запись под одной блокировкой"""
+        with self.lock:
+            self.annotations[key] = {**self.annotations.get(key, {}), name: value}
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[Timing]:
+        """Замер фазы: время считается всегда, rows/bytes — если их задали"""
+        timing = Timing()
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds = time.perf_counter() - started
+            key = (name, _labels(labels))
+            with self.lock:
+                phase = self.phases.setdefault(key, {'runs': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+                phase['runs'] += 1
+                phase['seconds'] += timing.seconds
+                phase['rows'] += timing.rows
+                phase['bytes'] += timing.bytes
+
+    def to_prometheus(self, job: str) -> str:
+        lines = []
+        with self.lock:
+            phase_names = sorted({name for name, _ in self.phases})
+            for name in phase_names:
+                for field, suffix in (('seconds', 'seconds_total'), ('rows', 'rows_total'),
+                                      ('bytes', 'bytes_total'), ('runs', 'runs_total')):
+                    metric = f"{PREFIX}{name}_{suffix}"
+                    lines.append(f"# TYPE {metric} counter")
+                    for (phase_name, labels), phase in sorted(self.phases.items()):
+                        if phase_name == name:
+                            lines.append(f"{metric}{_format_labels(labels, {'job': job})} {_format_value(phase[field])}")
+
+            for name in sorted({name for name, _ in self.counters}):
+                metric = f"{PREFIX}{name}"
+                lines.append(f"# TYPE {metric} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{metric}{_format_labels(labels, {'job': job})} {_format_value(value)}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                metric = f"{PREFIX}{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda i: i[0]):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                        lines.append(f"{metric}_bucket{_format_labels(labels, {'job': job, 'le': le})} {cumulative}")
+                    lines.append(f"{metric}_sum{_format_labels(labels, {'job': job})} {_format_value(histogram.sum)}")
+                    lines.append(f"{metric}_count{_format_labels(labels, {'job': job})} {histogram.count}")
+
+            lines.append(f"# TYPE {PREFIX}last_run_timestamp_seconds gauge")
+            lines.append(f'{PREFIX}last_run_timestamp_seconds{{job="{job}"}} {time.time():.0f}')
+            lines.append(f"# TYPE {PREFIX}last_run_duration_seconds gauge")
+            lines.append(f'{PREFIX}last_run_duration_seconds{{job="{job}"}} {time.time() - self.started_at:.3f}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self, job: str) -> Dict[str, Any]:
+        finished_at = time.time()
+        with self.lock:
+            phases = []
+            for (name, labels), phase in sorted(self.phases.items(), key=lambda i: -i[1]['seconds']):
+                seconds = phase['seconds']
+                phases.append({
+                    'name': name, **dict(labels), **phase,
+                    'seconds': round(seconds, 3),
+                    'rows_per_sec': round(phase['rows'] / seconds, 1) if seconds > 0 and phase['rows'] else None
+                })
+            histograms = [{
+                'name': name, **dict(labels),
+                'count': histogram.count,
+                'mean': round(histogram.sum / histogram.count, 4) if histogram.count else None,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+            } for (name, labels), histogram in sorted(self.histograms.items(), key=lambda i: i[0])]
+            counters = [{'name': name, **dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            return {
+                'job': job,
+                'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+                'finished_at': datetime.fromtimestamp(finished_at).isoformat(timespec='seconds'),
+                'duration_seconds': round(finished_at - self.started_at, 3),
+                'phases': phases,
+                'histograms': histograms,
+                'counters': counters,
+                **self.annotations,
+            }
+
+
+def _write_atomic(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(content, encoding='utf-8')
+    tmp_path.replace(path)
+
+
+def write_run_metrics(job: str, directory: Path = None) -> Path:
+    """Пишет время фаз, строки и байты запуска: <job>.prom для Prometheus
+    (перезаписывается каждым запуском) и JSON-сводку <job>_<время>.json"""
+    directory = directory or settings.app.metrics_dir
+    _write_atomic(directory / f"{job}.prom", metrics.to_prometheus(job))
+    summary_path = directory / f"{job}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    _write_atomic(summary_path, json.dumps(metrics.summary(job), indent=2, ensure_ascii=False, default=str))
+    return summary_path
+
+
+# Реестр процесса
+metrics = MetricsRegistry()
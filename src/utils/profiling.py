@@ -0,0 +1,158 @@
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.metrics import metrics
+
+PROFILE_MODES = ('cprofile', 'sample')
+HOTSPOTS_LIMIT = 15
+
+
+def add_profile_argument(parser: argparse.ArgumentParser):
+    """Общий для скриптов запуска флаг --profile"""
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                        help="профилировать запуск: cprofile (.prof) или sample (свернутые стеки) в logs/")
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер в стиле py-spy на чистом Python.
+
+    Фоновый поток раз в interval секунд снимает стеки всех потоков
+    процесса через sys._current_frames(), поэтому видны и потоки загрузки
+    DataLoader. Накладные расходы не зависят от числа вызовов функций,
+    в отличие от cProfile.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path: Path):
+        """Свернутые стеки для flamegraph.pl / speedscope / inferno"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def hotspots(self, limit: int = HOTSPOTS_LIMIT) -> List[Dict[str, Any]]:
+        """Функции с наибольшим числом собственных сэмплов (вершина стека)"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = sum(own.values()) or 1
+        return [{
+            'function': frame,
+            'self_pct': round(100 * count / samples, 1),
+            'total_pct': round(100 * total[frame] / samples, 1),
+        } for frame, count in own.most_common(limit)]
+
+
+def _cprofile_hotspots(profile: cProfile.Profile, limit: int = HOTSPOTS_LIMIT) -> List[Dict[str, Any]]:
+    stats = pstats.Stats(profile)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [{
+        'function': f"{name} ({os.path.basename(filename)}:{line})",
+        'calls': calls,
+        'tottime': round(tottime, 4),
+        'cumtime': round(cumtime, 4),
+    } for (filename, line, name), (_, calls, tottime, cumtime, _) in rows]
+
+
+@contextmanager
+def profiled(name: str, mode: Optional[str], directory: Path = Path("logs")) -> Iterator[None]:
+    """Профилирует блок, если задан mode; без mode ничего не делает.
+
+    cprofile — детерминированный профиль в logs/profile_<name>_<время>.prof
+    (snakeviz, gprof2dot, flameprof), видит только текущий поток; sample —
+    свернутые стеки всех потоков в logs/profile_<name>_<время>.folded
+    (flamegraph.pl, speedscope).
+    Горячие точки попадают в сводку метрик запуска под ключом hotspots.
+    """
+    if not mode:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Неизвестный режим профилирования: {mode}")
+
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = directory / f"profile_{name}_{datetime.now():%Y%m%d_%H%M%S}"
+    started = time.perf_counter()
+
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = SamplingProfiler()
+        profiler.start()
+
+    try:
+        yield
+    finally:
+        # Профиль сохраняется и при ошибке — медленный запуск мог упасть по таймауту
+        if mode == 'cprofile':
+            profiler.disable()
+            path = stem.with_suffix('.prof')
+            profiler.dump_stats(path)
+            hotspots = _cprofile_hotspots(profiler)
+        else:
+            profiler.stop()
+            path = stem.with_suffix('.folded')
+            profiler.write_folded(path)
+            hotspots = profiler.hotspots()
+
+        elapsed = time.perf_counter() - started
+        metrics.annotate_entry('hotspots', name, {
+            'mode': mode, 'seconds': round(elapsed, 3), 'output': str(path), 'top': hotspots,
+        })
+        logger.info(f"🔬 Профиль {name} ({mode}, {elapsed:.1f} с): {path}")
+        for spot in hotspots[:5]:
+            details = ', '.join(f"{key}={value}" for key, value in spot.items() if key != 'function')
+            logger.info(f"   {spot['function']}: {details}")
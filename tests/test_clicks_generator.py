@@ -0,0 +1,116 @@
+import itertools
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.etl.clicks_generator import ClicksGeneratorETL, POSITION_WEIGHTS, DEFAULT_POSITION_WEIGHT
+
+
+def click_weights(positions, orders) -> np.ndarray:
+    """Вес показа, как его описывает _distribute_clicks_batch"""
+    weights = [POSITION_WEIGHTS[p] if 1 <= p < len(POSITION_WEIGHTS) else DEFAULT_POSITION_WEIGHT
+               for p in positions]
+    return np.array(weights) / (np.asarray(orders) * 0.1 + 1)
+
+
+def inclusion_probabilities(weights: np.ndarray, k: int) -> np.ndarray:
+    """Вероятность попасть в выборку без повторов из k элементов при последовательном
+    выборе пропорционально весам (как np.random.choice с replace=False)"""
+    probabilities = np.zeros(len(weights))
+    for sequence in itertools.permutations(range(len(weights)), k):
+        p, remaining = 1.0, weights.sum()
+        for i in sequence:
+            p *= weights[i] / remaining
+            remaining -= weights[i]
+        probabilities[list(sequence)] += p
+    return probabilities
+
+
+@pytest.fixture
+def etl():
+    return ClicksGeneratorETL()
+
+
+def random_batch(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, 30, n)
+    offsets = np.append(0, np.cumsum(counts))
+    positions = rng.integers(1, 25, offsets[-1])
+    orders = np.concatenate([np.arange(1, c + 1) for c in counts])
+    clicks = np.minimum(rng.integers(0, 10, n), counts)
+    row_ids = np.arange(100, 100 + n)
+    seeds = rng.integers(0, 2 ** 63, n, dtype=np.uint64)
+    return row_ids, clicks, offsets, positions, orders, seeds
+
+
+def test_without_replacement_picks_distinct_impressions(etl):
+    row_ids, clicks, offsets, positions, orders, seeds = random_batch(500)
+    ids, click_positions, click_orders = etl._distribute_clicks_batch(
+        row_ids, clicks, offsets, positions, orders, seeds)
+
+    assert len(ids) == clicks.sum()
+    # Клики идут в порядке строк входа
+    assert np.all(np.diff(ids) >= 0)
+    for row, row_id in enumerate(row_ids):
+        start, end = offsets[row], offsets[row + 1]
+        chosen = click_orders[ids == row_id]
+        assert len(chosen) == clicks[row]
+        assert len(set(chosen.tolist())) == len(chosen)
+        by_order = dict(zip(orders[start:end].tolist(), positions[start:end].tolist()))
+        assert click_positions[ids == row_id].tolist() == [by_order[o] for o in chosen.tolist()]
+
+
+def test_without_replacement_follows_weights(etl):
+    positions = np.array([1, 2, 3, 12])
+    orders = np.array([1, 2, 3, 4])
+    weights = click_weights(positions, orders)
+    trials = 20000
+    seeds = np.random.default_rng(5).integers(0, 2 ** 63, trials, dtype=np.uint64)
+
+    for k in (1, 2):
+        ids, _, click_orders = etl._distribute_clicks_batch(
+            np.arange(trials), np.full(trials, k), np.arange(trials + 1) * len(positions),
+            np.tile(positions, trials), np.tile(orders, trials), seeds)
+        frequencies = np.bincount(click_orders - 1, minlength=len(positions)) / trials
+        expected = inclusion_probabilities(weights, k)
+        assert len(ids) == k * trials
+        np.testing.assert_allclose(frequencies, expected, atol=0.015)
+
+
+def test_with_replacement_follows_weights(etl):
+    positions = np.array([1, 3, 15])
+    orders = np.array([1, 2, 3])
+    clicks = 30000
+    ids, click_positions, click_orders = etl._distribute_clicks_batch(
+        np.array([1]), np.array([clicks]), np.array([0, 3]), positions, orders,
+        np.array([42], dtype=np.uint64))
+
+    assert len(ids) == clicks
+    weights = click_weights(positions, orders)
+    frequencies = np.bincount(click_orders - 1, minlength=3) / clicks
+    np.testing.assert_allclose(frequencies, weights / weights.sum(), atol=0.01)
+    assert set(click_positions.tolist()) <= set(positions.tolist())
+
+
+def test_rows_without_impressions_get_no_clicks(etl):
+    ids, _, _ = etl._distribute_clicks_batch(
+        np.array([1, 2]), np.array([3, 2]), np.array([0, 0, 2]),
+        np.array([1, 2]), np.array([1, 2]), np.array([1, 2], dtype=np.uint64))
+    assert ids.tolist() == [2, 2]
+
+
+def test_row_wrapper_matches_batch(etl):
+    row_ids, clicks, offsets, positions, orders, seeds = random_batch(40, seed=3)
+    ids, click_positions, click_orders = etl._distribute_clicks_batch(
+        row_ids, clicks, offsets, positions, orders, seeds)
+
+    for row, row_id in enumerate(row_ids):
+        start, end = offsets[row], offsets[row + 1]
+        pairs = list(zip(positions[start:end].tolist(), orders[start:end].tolist()))
+        single = etl._distribute_clicks(int(row_id), int(clicks[row]), pairs, int(seeds[row]))
+        mask = ids == row_id
+        assert [c['click_position'] for c in single] == click_positions[mask].tolist()
+        assert [c['impression_order'] for c in single] == click_orders[mask].tolist()
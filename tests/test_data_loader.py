@@ -0,0 +1,126 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.services.data_loader import DataLoader
+from src.services.checkpoint import BackfillCheckpoint
+
+
+class FakeClient:
+    """Клиент API: по две страницы по две строки на пару URL × устройство"""
+
+    def iter_query_pages(self, target_date, url, device):
+        for page in range(2):
+            yield [{'date': target_date, 'page_path': url, 'query': f"{device} {page} {i}", 'device': device}
+                   for i in range(2)]
+
+    def connection_stats(self):
+        return {'requests': 0, 'connections': 0, 'reused': 0}
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    loader = DataLoader(FakeClient())
+    loader.fetch_workers = 1
+    # Пакет из трех строк: страницы одной пары попадают в разные пакеты
+    loader.batch_size = 3
+    monkeypatch.setattr(loader, '_build_tasks', lambda target_date: [('u1', 'DESKTOP'), ('u1', 'MOBILE'),
+                                                                      ('u2', 'DESKTOP')])
+    return loader
+
+
+def test_failed_flush_leaves_pairs_unmarked(loader, tmp_path):
+    calls = []
+
+    def bulk_insert(records):
+        calls.append(len(records))
+        if len(calls) == 1:
+            raise RuntimeError("connection lost")
+        return len(records), 0
+
+    loader._bulk_insert = bulk_insert
+    checkpoint = BackfillCheckpoint(tmp_path / 'backfill.jsonl')
+    loader.load_data_for_date('2024-03-01', checkpoint=checkpoint)
+
+    assert loader.save_errors == 1
+    assert len(calls) > 1
+    resumed = BackfillCheckpoint(tmp_path / 'backfill.jsonl')
+    assert resumed.done_tasks == set()
+    assert resumed.done_dates == set()
+    assert resumed.started_dates() == {'2024-03-01'}
+
+
+def test_saved_pairs_are_marked(loader, tmp_path):
+    loader._bulk_insert = lambda records: (len(records), 0)
+    checkpoint = BackfillCheckpoint(tmp_path / 'backfill.jsonl')
+    loader.load_data_for_date('2024-03-01', checkpoint=checkpoint)
+
+    resumed = BackfillCheckpoint(tmp_path / 'backfill.jsonl')
+    assert resumed.done_tasks == {('2024-03-01', 'u1', 'DESKTOP'), ('2024-03-01', 'u1', 'MOBILE'),
+                                  ('2024-03-01', 'u2', 'DESKTOP')}
+    assert resumed.done_dates == {'2024-03-01'}
+
+
+class SlowClient(FakeClient):
+    """Первая пара падает на первой странице, у остальных много страниц"""
+
+    def __init__(self):
+        self.pages_requested = 0
+
+    def iter_query_pages(self, target_date, url, device):
+        if url == 'u0':
+            raise RuntimeError("API down")
+        for page in range(50):
+            self.pages_requested += 1
+            time.sleep(0.01)
+            yield [{'date': target_date, 'page_path': url, 'query': f"{page}", 'device': device}]
+
+
+def run_in_thread(func):
+    errors = []
+
+    def target():
+        try:
+            func()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), "загрузка зависла"
+    return errors
+
+
+def test_fetch_error_cancels_remaining_tasks():
+    client = SlowClient()
+    loader = DataLoader(client)
+    loader.fetch_workers = 2
+    loader._bulk_insert = lambda records: (len(records), 0)
+    loader._reset_state('2024-03-01')
+    tasks = [('u0', 'DESKTOP')] + [(f"u{i}", 'DESKTOP') for i in range(1, 20)]
+
+    errors = run_in_thread(lambda: loader._load_concurrently('2024-03-01', tasks))
+    assert [str(e) for e in errors] == ["API down"]
+    # Без отмены были бы запрошены все 19 × 50 страниц
+    assert client.pages_requested < 200
+
+
+def test_save_error_in_main_thread_does_not_hang():
+    client = SlowClient()
+    loader = DataLoader(client)
+    loader.fetch_workers = 4
+    loader._reset_state('2024-03-01')
+
+    def buffer_records(records):
+        raise RuntimeError("buffer failed")
+
+    loader._buffer_records = buffer_records
+    tasks = [(f"u{i}", 'DESKTOP') for i in range(1, 20)]
+
+    errors = run_in_thread(lambda: loader._load_concurrently('2024-03-01', tasks))
+    assert [str(e) for e in errors] == ["buffer failed"]
@@ -0,0 +1,110 @@
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.etl.positions_generator import PositionsGeneratorETL, MAX_TRIALS
+from src.etl.seeding import uniforms
+
+
+def reference_positions(impressions: int, avg_position: float, seed: int):
+    """Построчная реализация генерации циклами: сырые позиции и итоговые"""
+    min_pos = max(1, math.floor(avg_position - 1.5))
+    max_pos = math.ceil(avg_position + 1.5)
+    trials = max(0, max_pos - min_pos)
+    p = min(max((avg_position - min_pos) / trials, 0.05), 0.95) if trials > 0 else 0.05
+
+    raw = []
+    for j in range(impressions):
+        u = uniforms(np.full(MAX_TRIALS, seed, dtype=np.uint64),
+                     np.arange(j * MAX_TRIALS, (j + 1) * MAX_TRIALS, dtype=np.uint64))
+        raw.append(min_pos + sum(1 for k in range(trials) if u[k] < p))
+
+    diff = math.ceil(avg_position * impressions) - sum(raw)
+    positions = list(raw)
+    # Наименьшие позиции получают +1, наибольшие -1; при равенстве — по порядку показа
+    ascending = sorted(range(impressions), key=lambda i: (raw[i], i))
+    if diff > 0:
+        for i in ascending[:diff]:
+            positions[i] += 1
+    elif diff < 0:
+        for i in ascending[impressions + diff:]:
+            positions[i] = max(1, positions[i] - 1)
+    return raw, positions
+
+
+def make_rows(n: int, seed: int = 0, max_impressions: int = 60, max_position: float = 80.0):
+    rng = np.random.default_rng(seed)
+    impressions = rng.integers(0, max_impressions, n)
+    avg_positions = np.round(rng.uniform(1.0, max_position, n), 1)
+    seeds = rng.integers(0, 2 ** 63, n, dtype=np.uint64)
+    return impressions, avg_positions, seeds
+
+
+def split_rows(positions: np.ndarray, impressions: np.ndarray):
+    return np.split(positions, np.cumsum(impressions)[:-1])
+
+
+@pytest.fixture
+def etl():
+    return PositionsGeneratorETL()
+
+
+def test_batch_matches_row_by_row_reference(etl):
+    impressions, avg_positions, seeds = make_rows(300)
+    positions = etl._generate_positions_batch(impressions, avg_positions, seeds)
+
+    assert len(positions) == impressions.sum()
+    for row, generated in enumerate(split_rows(positions, impressions)):
+        _, expected = reference_positions(int(impressions[row]), float(avg_positions[row]), int(seeds[row]))
+        assert generated.tolist() == expected
+
+
+def test_sum_matches_target_when_correction_fits(etl):
+    impressions, avg_positions, seeds = make_rows(2000, seed=1)
+    positions = etl._generate_positions_batch(impressions, avg_positions, seeds)
+
+    for row, generated in enumerate(split_rows(positions, impressions)):
+        n, avg = int(impressions[row]), float(avg_positions[row])
+        raw, _ = reference_positions(n, avg, int(seeds[row]))
+        target = math.ceil(avg * n)
+        raw_diff = target - sum(raw)
+        if abs(raw_diff) <= n:
+            assert generated.sum() == target
+        elif avg >= 3:
+            # Каждая позиция сдвигается не больше чем на 1, поэтому остаток — |diff| - n
+            assert abs(int(generated.sum()) - target) == abs(raw_diff) - n
+
+
+def test_positions_stay_within_bounds(etl):
+    impressions, avg_positions, seeds = make_rows(2000, seed=2, max_position=120.0)
+    positions = etl._generate_positions_batch(impressions, avg_positions, seeds)
+
+    segment = np.repeat(np.arange(len(impressions)), impressions)
+    min_pos = np.maximum(1, np.floor(avg_positions - 1.5))[segment]
+    max_pos = np.ceil(avg_positions + 1.5)[segment]
+    assert positions.min() >= 1
+    assert np.all(positions >= np.maximum(1, min_pos - 1))
+    assert np.all(positions <= max_pos + 1)
+
+
+def test_top_position_is_never_below_one(etl):
+    positions = etl._generate_positions_array(50, 1.0, seed=7)
+    assert positions == [1] * 50
+
+
+def test_zero_impressions(etl):
+    assert etl._generate_positions_array(0, 5.0) == []
+    empty = etl._generate_positions_batch(np.array([0, 0]), np.array([3.0, 4.0]), np.array([1, 2], dtype=np.uint64))
+    assert len(empty) == 0
+
+
+def test_array_wrapper_matches_batch(etl):
+    impressions, avg_positions, seeds = make_rows(50, seed=3)
+    positions = etl._generate_positions_batch(impressions, avg_positions, seeds)
+    for row, generated in enumerate(split_rows(positions, impressions)):
+        single = etl._generate_positions_array(int(impressions[row]), float(avg_positions[row]), int(seeds[row]))
+        assert single == generated.tolist()
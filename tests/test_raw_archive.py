@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.api.raw_archive import RawArchive
+
+
+def responses(archive: RawArchive):
+    return [entry['response']['n'] for entry in archive.read('queries', '2024-03-01')]
+
+
+def test_torn_record_is_cut_before_next_append(tmp_path):
+    archive = RawArchive(tmp_path)
+    archive.append('queries', '2024-03-01', {'n': 1}, url='/a', device='desktop')
+    archive.append('queries', '2024-03-01', {'n': 2}, url='/b', device='desktop')
+    path = tmp_path / 'queries' / '2024-03-01.jsonl.gz'
+    path.write_bytes(path.read_bytes()[:-7])
+    assert responses(archive) == [1]
+
+    # Новый процесс дописывает в архив после аварии
+    restarted = RawArchive(tmp_path)
+    restarted.append('queries', '2024-03-01', {'n': 3}, url='/c', device='desktop')
+    assert responses(restarted) == [1, 3]
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    archive = RawArchive(tmp_path)
+    for n in (1, 2, 3):
+        archive.append('queries', '2024-03-01', {'n': n})
+    path = tmp_path / 'queries' / '2024-03-01.jsonl.gz'
+    data = bytearray(path.read_bytes())
+    first_length = int.from_bytes(data[:4], 'big')
+    second = 4 + first_length
+    # Портим тело второй записи, не трогая ее длину
+    data[second + 14:second + 24] = b'\x00' * 10
+    path.write_bytes(bytes(data))
+    assert responses(archive) == [1, 3]
@@ -0,0 +1,106 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.etl.seeding import row_seeds, uniforms
+from src.etl.positions_generator import PositionsGeneratorETL
+from src.etl.clicks_generator import ClicksGeneratorETL
+from src.etl.coordinator import split_id_range
+
+
+def aggregated_rows(n: int = 400, seed: int = 0) -> pd.DataFrame:
+    """Строки ppl.webmaster_aggregated, как их отдает extract() генераторов"""
+    rng = np.random.default_rng(seed)
+    impressions = rng.integers(0, 40, n)
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'date': pd.Timestamp('2024-03-01').date(),
+        'query': [f"query {i % 97}" for i in range(n)],
+        'page_path': [f"/page/{i % 13}" for i in range(n)],
+        'device': np.array(['desktop', 'mobile', 'tablet'])[np.arange(n) % 3],
+        'impressions': impressions,
+        'clicks': np.minimum(rng.integers(0, 8, n), impressions),
+        'position': np.round(rng.uniform(1, 40, n), 1),
+    })
+
+
+def chunks(df: pd.DataFrame, size: int):
+    return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+
+def shards(df: pd.DataFrame, count: int):
+    return [df[(df['id'] > id_from) & (df['id'] <= id_to)]
+            for id_from, id_to in split_id_range(int(df['id'].min()), int(df['id'].max()), count)]
+
+
+def test_row_seeds_do_not_depend_on_chunking():
+    df = aggregated_rows()
+    whole = row_seeds(0, 'positions', df)
+    assert np.array_equal(whole, np.concatenate([row_seeds(0, 'positions', c) for c in chunks(df, 37)]))
+
+    shuffled = df.sample(frac=1, random_state=1)
+    assert np.array_equal(row_seeds(0, 'positions', shuffled), whole[shuffled.index.to_numpy()])
+
+
+def test_row_seeds_depend_on_run_seed_and_stage():
+    df = aggregated_rows(50)
+    base = row_seeds(0, 'positions', df)
+    assert not np.array_equal(base, row_seeds(1, 'positions', df))
+    assert not np.array_equal(base, row_seeds(0, 'clicks', df))
+    # Суррогатный id в зерно не входит: та же строка с другим id дает то же зерно
+    assert np.array_equal(base, row_seeds(0, 'positions', df.assign(id=df['id'] + 1000)))
+
+
+def test_uniforms_are_counter_based():
+    seeds = np.array([1, 2, 3], dtype=np.uint64)
+    counters = np.array([0, 5, 9], dtype=np.uint64)
+    values = uniforms(seeds, counters)
+    assert np.all((values > 0) & (values < 1))
+    assert np.array_equal(values, uniforms(seeds, counters))
+    # Каждое число зависит только от своей пары (зерно, номер)
+    assert values[1] == uniforms(seeds[1:2], counters[1:2])[0]
+
+    sample = uniforms(np.full(100000, 7, dtype=np.uint64), np.arange(100000, dtype=np.uint64))
+    assert abs(sample.mean() - 0.5) < 0.01
+
+
+@pytest.mark.parametrize('split', [lambda df: chunks(df, 1), lambda df: chunks(df, 53),
+                                   lambda df: shards(df, 4)])
+def test_positions_identical_for_any_split(split):
+    etl = PositionsGeneratorETL()
+    df = aggregated_rows()
+    df = df[df['impressions'] > 0]
+
+    whole = etl.transform(df)
+    parts = pd.concat([etl.transform(part) for part in split(df)], ignore_index=True)
+    pd.testing.assert_frame_equal(whole, parts)
+
+
+@pytest.mark.parametrize('split', [lambda df: chunks(df, 1), lambda df: chunks(df, 29),
+                                   lambda df: shards(df, 3)])
+def test_clicks_identical_for_any_split(split):
+    df = aggregated_rows(seed=1)
+    positions = PositionsGeneratorETL().transform(df[df['impressions'] > 0])
+    positions = positions.sort_values(['id', 'impression_order'])
+
+    def positions_for_ids(db, row_ids):
+        found = positions[positions['id'].isin(row_ids)]
+        return (found['id'].to_numpy(), found['impression_position'].to_numpy(),
+                found['impression_order'].to_numpy())
+
+    whole_etl = ClicksGeneratorETL()
+    whole_etl._get_positions_for_ids = positions_for_ids
+    split_etl = ClicksGeneratorETL()
+    split_etl._get_positions_for_ids = positions_for_ids
+    # Пачки запросов позиций тоже не должны влиять на результат
+    split_etl.batch_size = 7
+
+    df = df[df['clicks'] > 0]
+    whole = whole_etl.transform(df)
+    parts = pd.concat([split_etl.transform(part) for part in split(df)], ignore_index=True)
+    pd.testing.assert_frame_equal(whole, parts)
+    assert len(whole) == df['clicks'].sum()
@@ -0,0 +1,63 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.api.webmaster_client import WebmasterClient, WebmasterAPIError
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, text='{}'):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = WebmasterClient()
+    client.max_retries = 2
+    client.backoff_base = client.backoff_max = 0
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    return client
+
+
+def fake_post(client, *outcomes):
+    calls = []
+
+    def post(*args, **kwargs):
+        outcome = outcomes[len(calls)]
+        calls.append(outcome)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    client.session.post = post
+    return calls
+
+
+def test_transient_errors_are_retried(client):
+    calls = fake_post(client, requests.exceptions.ChunkedEncodingError("oops"),
+                      FakeResponse(text='{"ok": 1}'))
+    assert client._post_json('http://api/x', {}) == {'ok': 1}
+    assert len(calls) == 2
+
+
+def test_other_request_errors_become_api_errors(client):
+    calls = fake_post(client, requests.exceptions.InvalidHeader("bad header"))
+    with pytest.raises(WebmasterAPIError):
+        client._post_json('http://api/x', {})
+    assert len(calls) == 1
+
+
+def test_non_json_response_becomes_api_error(client):
+    fake_post(client, FakeResponse(text='<html>gateway</html>'))
+    with pytest.raises(WebmasterAPIError):
+        client._post_json('http://api/x', {})